@@ -7,8 +7,6 @@ export PYTHONPATH=$BASE_DIR
 source .venv/bin/activate
 
 uv run src/mcp_server/main.py \
-    --confluence \
-    --confluence_path index/confluence_pages_index \
-    --guidebook \
-    --guidebook_path index/eng_handbook_index \
-    --top_k 5
\ No newline at end of file
+    --sources sources.json \
+    --top_k 5 \
+    "$@"
\ No newline at end of file
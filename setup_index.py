@@ -5,6 +5,7 @@ This script provides a more maintainable and extensible alternative to the bash
 """
 
 import argparse
+import logging
 import os
 import sys
 import tempfile
@@ -14,19 +15,23 @@ from typing import List, Optional
 # Add src to path to import our modules
 sys.path.insert(0, str(Path(__file__).parent / "src"))
 
-from retrieval_stuff.confluence_scraper import ConfluenceScraper
-from retrieval_stuff.document_parser import ConfluenceDocumentParser, EngHandbookDocumentParser
-from retrieval_stuff.index import HuggingFaceVectorStoreIndex
+# Scraper, parsers and index pull in llama_index and torch, so they're imported by the builders
+# that use them and --help or a bad argument returns straight away
+from retrieval_stuff.sources import SourceConfig, load_sources, DEFAULT_SOURCES_FILE
 import dotenv
 
 
 class IndexBuilder:
     """Base class for building different types of indexes."""
     
-    def __init__(self, chunk_size: int, embed_model: str, dimension: int):
+    def __init__(self, chunk_size: int, embed_model: str, dimension: int,
+                 vector_dtype: str = "float32", reduced_dim: Optional[int] = None, reduction: str = "pca"):
         self.chunk_size = chunk_size
         self.embed_model = embed_model
         self.dimension = dimension
+        self.vector_dtype = vector_dtype
+        self.reduced_dim = reduced_dim
+        self.reduction = reduction
         
     def build(self, **kwargs):
         """Build the index. To be implemented by subclasses."""
@@ -37,8 +42,12 @@ class ConfluenceIndexBuilder(IndexBuilder):
     """Builder for Confluence indexes."""
     
     def build(self, space_keys: List[str], env_path: str = ".env", 
-              index_path: str = "./index/confluence_pages_index"):
+              index_path: str = "./index/confluence_pages_index", index_name: str = "confluence"):
         """Build Confluence index."""
+        from retrieval_stuff.confluence_scraper import ConfluenceScraper
+        from retrieval_stuff.document_parser import ConfluenceDocumentParser
+        from retrieval_stuff.index import HuggingFaceVectorStoreIndex
+
         print(f"Building Confluence index with spaces: {space_keys}")
         
         # Load environment variables
@@ -59,11 +68,14 @@ class ConfluenceIndexBuilder(IndexBuilder):
             
             # Create and store index
             index = HuggingFaceVectorStoreIndex(
-                index_name="confluence_pages",
+                index_name=index_name,
                 path=index_path,
                 chunk_size=self.chunk_size,
                 hf_name=self.embed_model,
-                dimension=self.dimension
+                dimension=self.dimension,
+                vector_dtype=self.vector_dtype,
+                reduced_dim=self.reduced_dim,
+                reduction=self.reduction
             )
             index.create(documents)
             index.store()
@@ -75,8 +87,11 @@ class HandbookIndexBuilder(IndexBuilder):
     """Builder for Engineering Handbook indexes."""
     
     def build(self, handbook_path: str, 
-              index_path: str = "./index/eng_handbook_index"):
+              index_path: str = "./index/eng_handbook_index", index_name: str = "guidebook"):
         """Build Engineering Handbook index."""
+        from retrieval_stuff.document_parser import EngHandbookDocumentParser
+        from retrieval_stuff.index import HuggingFaceVectorStoreIndex
+
         print("Building Engineering Handbook index...")
         
         # Check if handbook path exists
@@ -92,11 +107,14 @@ class HandbookIndexBuilder(IndexBuilder):
         
         # Create and store index
         index = HuggingFaceVectorStoreIndex(
-            index_name="eng_handbook",
+            index_name=index_name,
             path=index_path,
             chunk_size=self.chunk_size,
             hf_name=self.embed_model,
-            dimension=self.dimension
+            dimension=self.dimension,
+            vector_dtype=self.vector_dtype,
+            reduced_dim=self.reduced_dim,
+            reduction=self.reduction
         )
         index.create(documents)
         index.store()
@@ -104,6 +122,36 @@ class HandbookIndexBuilder(IndexBuilder):
         print("✓ Engineering Handbook index built successfully")
 
 
+# Source type in the registry -> builder
+BUILDERS = {"confluence": ConfluenceIndexBuilder, "handbook": HandbookIndexBuilder}
+
+
+def build_source(source: SourceConfig, args: argparse.Namespace):
+    """Build the index of one registry source. Command line options override the registry's."""
+    options = source.options
+    builder = BUILDERS[source.type](
+        chunk_size=args.chunk_size or options.get("chunk_size", 2048),
+        embed_model=args.embed_model or source.model,
+        dimension=args.dimension or source.dimension,
+        vector_dtype=args.vector_dtype or options.get("vector_dtype", "float32"),
+        reduced_dim=args.reduced_dim or options.get("reduced_dim"),
+        reduction=args.reduction or options.get("reduction", "pca")
+    )
+    if source.type == "confluence":
+        builder.build(
+            space_keys=args.space_keys or options.get("spaces", []),
+            env_path=args.env_path,
+            index_path=source.index_path,
+            index_name=source.name
+        )
+    else:
+        builder.build(
+            handbook_path=os.path.expanduser(os.path.expandvars(args.handbook_path or options["handbook_path"])),
+            index_path=source.index_path,
+            index_name=source.name
+        )
+
+
 def setup_environment():
     """Setup environment similar to the bash script."""
     # Check if .env file exists
@@ -127,6 +175,8 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Examples:
+  %(prog)s --all
+  %(prog)s --source guidebook
   %(prog)s --confluence ResDev EN
   %(prog)s --handbook
   %(prog)s --confluence --handbook ResDev EN DEVOPS
@@ -134,44 +184,81 @@ Examples:
         """
     )
     
-    # Index type flags
+    # Source selection
+    parser.add_argument(
+        "--sources",
+        type=str,
+        default=DEFAULT_SOURCES_FILE,
+        help=f"Source registry listing the indexes, their paths and build options (default: {DEFAULT_SOURCES_FILE})"
+    )
+    parser.add_argument(
+        "--source",
+        action="append",
+        default=[],
+        help="Build the source with this name from the registry (repeatable)"
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Build every source in the registry"
+    )
     parser.add_argument(
         "--confluence", 
         action="store_true",
-        help="Enable building confluence index"
+        help="Build every confluence source in the registry"
     )
     parser.add_argument(
         "--handbook", 
         action="store_true",
-        help="Enable building handbook index"
+        help="Build every handbook source in the registry"
     )
     
-    # Configuration arguments
+    # Configuration arguments, overriding the registry's
     parser.add_argument(
         "--embed_model",
         type=str,
-        default="avsolatorio/GIST-small-Embedding-v0",
-        help="Embedding model to use (default: avsolatorio/GIST-small-Embedding-v0)"
+        default=None,
+        help="Embedding model to use (default: the source's model)"
     )
     parser.add_argument(
         "--chunk_size",
         type=int,
-        default=2048,
-        help="Size of the chunks (default: 2048)"
+        default=None,
+        help="Size of the chunks (default: the source's chunk_size, else 2048)"
     )
     parser.add_argument(
         "--dimension",
         type=int,
-        default=384,
-        help="Dimension of the embedding model (default: 384)"
+        default=None,
+        help="Dimension of the embedding model (default: the source's dimension)"
+    )
+    parser.add_argument(
+        "--vector_dtype",
+        type=str,
+        choices=["float32", "float16", "sq8"],
+        default=None,
+        help="How vectors are stored: float32, float16 or sq8 8-bit scalar quantization (default: the source's vector_dtype, else float32)"
+    )
+    parser.add_argument(
+        "--reduced_dim",
+        type=int,
+        default=None,
+        help="Reduce vectors to this many dimensions before storing them (default: no reduction)"
+    )
+    parser.add_argument(
+        "--reduction",
+        type=str,
+        choices=["pca", "truncate"],
+        default=None,
+        help="Dimensionality reduction used with --reduced_dim: pca or Matryoshka-style truncate (default: the source's reduction, else pca)"
     )
     
     # Path arguments
     parser.add_argument(
         "--handbook_path",
         type=str,
-        default="/Users/sam.onuallain/Klaviyo/Repos/eng-handbook",
-        help="Path to the engineering handbook directory"
+        default=None,
+        help="Path to the engineering handbook directory (default: the source's handbook_path)"
     )
     parser.add_argument(
         "--env_path",
@@ -184,25 +271,39 @@ Examples:
     parser.add_argument(
         "space_keys",
         nargs="*",
-        help="Confluence space keys (required if --confluence is used)"
+        help="Confluence space keys (default: the source's spaces)"
     )
     
     args = parser.parse_args()
+    # Progress of the index build is logged by the library
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     
     # Validate arguments
-    if not args.confluence and not args.handbook:
-        parser.error("At least one of --confluence or --handbook must be specified")
-    
-    if args.confluence and not args.space_keys:
-        parser.error("Space keys are required when --confluence is used")
+    try:
+        registry = load_sources(args.sources)
+    except (OSError, ValueError, TypeError) as e:
+        parser.error(f"Could not read the source registry: {e}")
+    unknown = set(args.source) - {source.name for source in registry}
+    if unknown:
+        parser.error(f"Unknown sources: {', '.join(sorted(unknown))}")
+    selected = [
+        source for source in registry
+        if args.all or source.name in args.source
+        or (args.confluence and source.type == "confluence") or (args.handbook and source.type == "handbook")
+    ]
+    if not selected:
+        parser.error("Select the sources to build with --source, --all, --confluence or --handbook")
+    for source in selected:
+        if source.type == "confluence" and not (args.space_keys or source.options.get("spaces")):
+            parser.error(f"Space keys are required for {source.name}: pass them or set its spaces in {args.sources}")
+        if source.type == "handbook" and not (args.handbook_path or source.options.get("handbook_path")):
+            parser.error(f"A handbook path is required for {source.name}: pass --handbook_path or set its handbook_path in {args.sources}")
     
     print("Setting up indexes...")
-    print(f"Confluence: {args.confluence}")
-    print(f"Handbook: {args.handbook}")
-    print(f"Embedding model: {args.embed_model}")
-    print(f"Chunk size: {args.chunk_size}")
-    
-    if args.confluence:
+    print(f"Sources: {', '.join(source.name for source in selected)}")
+    if args.embed_model:
+        print(f"Embedding model: {args.embed_model}")
+    if args.space_keys:
         print(f"Space keys: {args.space_keys}")
     
     try:
@@ -210,24 +311,8 @@ Examples:
         setup_environment()
         
         # Build indexes
-        if args.confluence:
-            builder = ConfluenceIndexBuilder(
-                chunk_size=args.chunk_size,
-                embed_model=args.embed_model,
-                dimension=args.dimension
-            )
-            builder.build(
-                space_keys=args.space_keys,
-                env_path=args.env_path
-            )
-        
-        if args.handbook:
-            builder = HandbookIndexBuilder(
-                chunk_size=args.chunk_size,
-                embed_model=args.embed_model,
-                dimension=args.dimension
-            )
-            builder.build(handbook_path=args.handbook_path)
+        for source in selected:
+            build_source(source, args)
         
         print("\nSetup completed successfully!\n")
         print("You can now run the MCP server with:")
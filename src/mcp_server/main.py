@@ -1,16 +1,61 @@
-from typing import Any
-import httpx
-from mcp.server.fastmcp import FastMCP
-import mcp.types as types
+from typing import TYPE_CHECKING
+from mcp.server.fastmcp import FastMCP, Context
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
 import argparse
+import asyncio
+import logging
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
 
-from src.retrieval_stuff.index import HuggingFaceVectorStoreIndex
-from src.retrieval_stuff.retriever import HuggingFaceVectorRetriever
+# Only lightweight modules are imported up front, so the server answers the client's handshake
+# straight away. The search stack (LlamaIndex, FAISS, torch, sentence-transformers) takes seconds
+# to import and is imported on a loader thread once the server is up, see setup_retrieval.
+from src.retrieval_stuff.loader import BackgroundLoader
+from src.retrieval_stuff.pagination import ResultPager
+from src.retrieval_stuff.sources import SourceConfig, load_sources, DEFAULT_SOURCES_FILE
+from src.retrieval_stuff.embedding import embedding_registry
+from src.retrieval_stuff.metrics import metrics
 
-confluence_index = None
-confluence_retriever = None
-guidebook_index = None
-guidebook_retriever = None
+if TYPE_CHECKING:
+    from src.retrieval_stuff.live_index import LiveRetriever
+    from src.retrieval_stuff.retriever import HuggingFaceVectorRetriever
+
+logger = logging.getLogger(__name__)
+
+# Knowledge bases being served; each is loaded by the loader under the same name
+sources = []
+# Source name -> function loading it, for sources loaded by their first request and loads that failed
+source_loads = {}
+# Sets up what every source shares, see setup_retrieval
+retrieval_load = None
+loader = None
+warmup_wait = 10.0
+federated_search = None
+rerank = False
+search_executor = None
+search_timeout = 30.0
+max_pending_searches = 16
+pending_searches = 0
+max_searches_per_client = 2
+# Client session -> semaphore limiting how many of its searches run at once
+client_slots = weakref.WeakKeyDictionary()
+# Keeps ranked results for cursors; None when paging is disabled
+pager = None
+max_results = 50
+# Default size of a get_document reply
+document_chars = 16000
+
+@asynccontextmanager
+async def keep_stdout_for_protocol(server: FastMCP):
+    # The stdio transport holds its own handle on stdout by now; anything else printed there
+    # (e.g. by a library) would corrupt the protocol stream, so send it to stderr instead
+    sys.stdout = sys.stderr
+    yield
 
 # Initialize FastMCP server
 mcp = FastMCP(
@@ -18,44 +63,490 @@ mcp = FastMCP(
     instructions="""This server provides access to Klaviyo's engineering documentation and resources.
                     It is designed to help developers and engineers find information about Klaviyo's products,
                     processes, and best practices.
-                    It has access to Klaviyo's confluence knowledge base, and its engineering guidebook which has information about common engineering tasks and processes.""")
+                    It has access to Klaviyo's confluence knowledge base, and its engineering guidebook which has information about common engineering tasks and processes.""",
+    lifespan=keep_stdout_for_protocol)
+
+async def run_search(search, ctx: Context | None = None, name: str = "search") -> str:
+    """
+    Run a blocking search (a function returning the tool response) on the worker pool so the event loop stays free for other requests and pings.
+
+    Each client (MCP session) runs at most max_searches_per_client searches at a time; the rest wait
+    for one of its slots, so one busy agent can't take every worker from the other clients sharing
+    the server. Searches that take longer than search_timeout, waiting included, are abandoned: the
+    caller gets a timeout message and, if the search hasn't started yet, it is dropped from the queue.
+    A search already running can't be interrupted; it finishes in the background and its results
+    still land in the caches. The same goes for requests the client cancels. When too many searches
+    are waiting, new ones are turned away rather than queued behind them.
+
+    The time each search spends in every stage is recorded under the tool's name.
+    """
+    global pending_searches
+    if pending_searches >= max_pending_searches:
+        metrics.increment("searches_rejected")
+        return "The search server is busy, please retry shortly."
+
+    slots = None
+    if ctx is not None:
+        slots = client_slots.get(ctx.session)
+        if slots is None:
+            slots = client_slots[ctx.session] = asyncio.Semaphore(max_searches_per_client)
+
+    async def run() -> str:
+        async with slots if slots is not None else nullcontext():
+            submitted = time.perf_counter()
+
+            def traced_search() -> str:
+                metrics.observe("queue", time.perf_counter() - submitted)
+                with metrics.trace(name):
+                    return search()
+            return await asyncio.get_running_loop().run_in_executor(search_executor, traced_search)
+
+    pending_searches += 1
+    try:
+        return await asyncio.wait_for(run(), timeout=search_timeout)
+    except asyncio.TimeoutError:
+        metrics.increment("searches_timed_out")
+        return f"Search timed out after {search_timeout:g}s. Try a more specific query."
+    finally:
+        pending_searches -= 1
+
+async def wait_for_sources(names: list[str]) -> tuple[dict[str, "LiveRetriever"], list[str]]:
+    """
+    Wait up to warmup_wait seconds for knowledge bases that are still loading.
+
+    Returns the retrievers of the knowledge bases that are ready and a message for each of the others.
+    """
+    # Lazily loaded sources start loading here, on the first request that needs them. Failed loads are
+    # retried, the shared setup first so it's queued ahead of the knowledge bases waiting on it.
+    if retrieval_load is not None and any(name in source_loads for name in names):
+        loader.start("retrieval", retrieval_load)
+    futures = {name: loader.start(name, source_loads[name]) if name in source_loads else loader.future(name)
+               for name in names}
+    loading = [asyncio.wrap_future(future) for future in futures.values() if future is not None and not future.done()]
+    if loading:
+        # Doesn't cancel the loads on timeout, the next call picks up where this one left off
+        await asyncio.wait(loading, timeout=warmup_wait)
+
+    status = loader.status()
+    retrievers, messages = {}, []
+    for name, future in futures.items():
+        if future is None:
+            messages.append(f"Knowledge base '{name}' is not loaded. Available: {', '.join(sources)}.")
+        elif not future.done():
+            messages.append(f"Knowledge base '{name}' is still warming up ({status[name]['seconds']:.0f}s so far). Retry shortly.")
+        elif future.exception() is not None:
+            messages.append(f"Knowledge base '{name}' failed to load: {future.exception()}")
+        else:
+            retrievers[name] = future.result()
+    return retrievers, messages
+
+def format_status() -> str:
+    status = loader.status()
+    lines = [f"{'Ready' if loader.ready() else 'Warming up'}: {sum(item['state'] == 'ready' for item in status.values())}/{len(status)} components loaded"]
+    for name, item in status.items():
+        line = f"{name}: {item['state']} ({item['seconds']:.1f}s)"
+        retriever = loader.get(name)
+        if name in sources and retriever is not None:
+            line += f", index version {retriever.version}"
+            stats = retriever.warmup_stats
+            if stats:
+                line += f", warmup: first query {stats['cold_ms']:.0f}ms"
+                if stats["warm_ms"] is not None:
+                    line += f", then {stats['warm_ms']:.0f}ms"
+        if item["state"] == "failed":
+            line += f", error: {item['error']}"
+        lines.append(line)
+    lines += [f"{name}: not loaded yet, loads on first use" for name in sources if name not in status]
+    return "\n".join(lines)
+
+def format_page(results: list[str], cursor: str | None, tool: str) -> str:
+    from src.retrieval_stuff.response import OMITTED_NOTE, OMITTED_PAGED_NOTE
+    if cursor is not None and results and results[-1].endswith(OMITTED_NOTE):
+        # The results left out to fit the budget are on the next page
+        results = results[:-1] + [results[-1][:-len(OMITTED_NOTE)] + OMITTED_PAGED_NOTE]
+    response = "\n".join(results)
+    if cursor is not None:
+        response += f'\nMore results are available: call {tool} with cursor="{cursor}" for the next page.'
+    return response
+
+def count_shown(results: list[str]) -> tuple[list[str], int]:
+    """
+    Pair formatted results with the number of candidates they show, without the note on omitted ones.
+    """
+    from src.retrieval_stuff.response import OMITTED_NOTE
+    omitted = bool(results) and results[-1].endswith(OMITTED_NOTE)
+    return results, len(results) - omitted
+
+def first_page(key: tuple, results: list[str], rank, format_results, tool: str) -> str:
+    """
+    Return the first page of a search with a cursor to the next one, starting after the last result
+    shown. The rest of the ranking, up to max_results, is only computed (blocking) when the cursor is followed.
+    """
+    results, shown = count_shown(results)
+    # A full page, or one cut short by the response budget, may have more results after it
+    more = shown >= pager.page_size or shown < len(results)
+    return format_page(*pager.first_page(key, results, shown, more, rank, lambda page: count_shown(format_results(page))), tool)
+
+async def next_page(cursor: str, ctx: Context | None, tool: str) -> str:
+    """
+    Page through the results of an earlier search, without searching again.
+    """
+    def page() -> str:
+        try:
+            results, next_cursor = pager.next_page(cursor)
+            return format_page(results, next_cursor, tool) if results else "No more results."
+        except ValueError as e:
+            return str(e)
+    if pager is None:
+        return "Paging is disabled on this server."
+    return await run_search(page, ctx, "next_page")
+
+def search_source(retriever: "HuggingFaceVectorRetriever", query: str, filters: dict[str, str], tool: str) -> str:
+    from src.retrieval_stuff.retriever import normalize_query, filter_key
+    if pager is None:
+        return "\n".join(retriever.retrieve(query, rerank=rerank, filters=filters))
+    index = retriever.index
+    key = (index.index_name, index.version, index.revision, normalize_query(query), rerank, filter_key(filters))
+    # The first page goes through the result and semantic caches like any other search
+    return first_page(
+        key,
+        retriever.retrieve(query, rerank=rerank, filters=filters),
+        lambda: retriever.retrieve_nodes(query, rerank=rerank, top_k=max_results, filters=filters),
+        lambda nodes: retriever.format_nodes(nodes, query),
+        tool)
+
+@mcp.tool()
+async def server_status() -> str:
+    """Report whether the knowledge bases and models are loaded. Searches made while the server is warming up wait briefly, then ask to retry."""
+    return format_status()
+
+@mcp.resource("status://server")
+def server_status_resource() -> str:
+    """Load progress of the knowledge bases and models."""
+    return format_status()
+
+@mcp.resource("metrics://latency")
+def latency_metrics_resource() -> str:
+    """Search latency per stage (p50/p95/p99), cache hit rates and counters since the server started."""
+    return metrics.format_summary()
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def prometheus_metrics(request: Request) -> PlainTextResponse:
+    # Only served by the HTTP transports
+    return PlainTextResponse(metrics.to_prometheus(), media_type="text/plain; version=0.0.4")
+
+async def search_knowledge_base(name: str, tool: str, query: str, filters: dict[str, str], cursor: str | None, ctx: Context | None) -> str:
+    if cursor:
+        return await next_page(cursor, ctx, tool)
+    retrievers, messages = await wait_for_sources([name])
+    if not retrievers:
+        return "\n".join(messages)
+    # Pages are formatted by the index version that ranked them, even after a reload
+    retriever = retrievers[name].retriever
+    return await run_search(lambda: search_source(retriever, query, filters, tool), ctx, tool)
+
+SEARCH_ARGS = """
+    Args:
+        query: The search query.{filters}
+        title_prefix: Only search {items} whose title starts with this.
+        cursor: Cursor from a previous response, to get the next page of its results."""
+
+def register_search_tool(source: SourceConfig):
+    """
+    Add the search tool of a knowledge base; the filters it takes depend on the type of source.
+    """
+    if source.type == "confluence":
+        async def search(query: str, space: str | None = None, title_prefix: str | None = None,
+                         cursor: str | None = None, ctx: Context = None) -> str:
+            filters = {"space": space, "title_prefix": title_prefix}
+            return await search_knowledge_base(source.name, source.tool, query, filters, cursor, ctx)
+        args = SEARCH_ARGS.format(items="pages", filters="""
+        space: Only search pages in this Confluence space (space key, e.g. "EN").""")
+    else:
+        async def search(query: str, subdirectory: str | None = None, title_prefix: str | None = None,
+                         cursor: str | None = None, ctx: Context = None) -> str:
+            filters = {"subdirectory": subdirectory, "title_prefix": title_prefix}
+            return await search_knowledge_base(source.name, source.tool, query, filters, cursor, ctx)
+        args = SEARCH_ARGS.format(items="files", filters="""
+        subdirectory: Only search files in this directory (and the directories below it).""")
+    mcp.add_tool(search, name=source.tool, description=source.description + "\n" + args)
+
+@mcp.tool()
+async def search_many(queries: list[str], source: str | None = None, title_prefix: str | None = None, ctx: Context = None) -> str:
+    """Run several searches against one Klaviyo knowledge base in a single call. Prefer this over repeated single searches when you have multiple related questions.
+
+    Args:
+        queries: The search queries.
+        source: Knowledge base to search (e.g. "confluence" or "guidebook", see server_status); the first one by default.
+        title_prefix: Only search pages/files whose title starts with this.
+    """
+    source = source or sources[0]
+    retrievers, messages = await wait_for_sources([source])
+    if not retrievers:
+        return "\n".join(messages)
+    retriever = retrievers[source]
+
+    def search() -> str:
+        results = retriever.retrieve_many(queries, rerank=rerank, filters={"title_prefix": title_prefix})
+        return "\n".join(f"Results for query: {query}\n" + "\n".join(query_results) for query, query_results in zip(queries, results))
+    return await run_search(search, ctx, "search_many")
+
+def read_document(live_retrievers: dict[str, "LiveRetriever"], doc_id: str, section: str | None, offset: int, max_chars: int) -> str | None:
+    """
+    Read a document from the parent store of the first knowledge base that has it, None if none does.
+    The vector index isn't searched.
+    """
+    for name, live in live_retrievers.items():
+        store = live.retriever.index.get_parent_store()
+        length = store.length(doc_id)
+        if length is None:
+            continue
+
+        sections = store.sections(doc_id)
+        start, end = 0, length
+        if section:
+            match = next((item for item in sections if item["title"].casefold() == section.strip().casefold()), None)
+            if match is None:
+                headings = ", ".join(item["title"] for item in sections)
+                return f"Document '{doc_id}' has no section '{section}'." + (f" Its sections are: {headings}" if headings else "")
+            start, end = match["start"], match["end"]
+        # The offset counts from the start of the section, if one was asked for
+        first = min(start + max(offset, 0), end)
+        last = min(first + max_chars, end)
+
+        lines = [f"Document id: {doc_id} (from {name})", f"Characters {first}-{last} of {length}"]
+        if last < end:
+            lines[-1] += f"; call get_document again with offset={last - start} for the rest"
+        if sections and not section and first == 0:
+            lines.append("Sections: " + ", ".join(item["title"] for item in sections))
+        lines += [" -----------", store.get_text(doc_id, first, last)]
+        return "\n".join(lines)
+    return None
 
 @mcp.tool()
-def search_confluence(query: str) -> str:
-    """Search Klaviyo's confluence knowledge base for information."""
-    return "\n".join(confluence_retriever.retrieve(query))
+async def get_document(doc_id: str, section: str | None = None, offset: int = 0, max_chars: int | None = None, ctx: Context = None) -> str:
+    """Fetch a whole Confluence page or guidebook file by the document id shown with search results. Use it when a result was cut short or you need the rest of the page, instead of searching again.
+
+    Args:
+        doc_id: Document id of a search result.
+        section: Only return the section under this heading (for markdown files).
+        offset: Character to start reading from, to continue a long document.
+        max_chars: Max characters to return.
+    """
+    # The document came from a search result, so its knowledge base has been loaded; don't load the others for it
+    live_retrievers, messages = await wait_for_sources([name for name in sources if loader.future(name) is not None])
+    if not live_retrievers:
+        return "\n".join(messages) or "No knowledge bases are loaded."
+    response = await run_search(
+        lambda: read_document(live_retrievers, doc_id, section, offset, max_chars or document_chars), ctx, "get_document")
+    if response is None:
+        # It may be in a knowledge base that isn't loaded yet
+        return "\n".join([f"No document with id '{doc_id}'. Use the document id shown with a search result."] + messages)
+    return response
 
 @mcp.tool()
-def search_engineering_guidebook(query: str) -> str:
-    """Search Klaviyo's engineering guidebook for information."""
-    return "\n".join(guidebook_retriever.retrieve(query))
+async def search_all(query: str, title_prefix: str | None = None, cursor: str | None = None, ctx: Context = None) -> str:
+    """Search every Klaviyo knowledge base (e.g. confluence, engineering guidebook) at once and return the best results across them.
+
+    Args:
+        query: The search query.
+        title_prefix: Only search pages/files whose title starts with this.
+        cursor: Cursor from a previous response, to get the next page of its results.
+    """
+    if cursor:
+        return await next_page(cursor, ctx, "search_all")
+    # Knowledge bases still warming up are left out and mentioned above the results
+    live_retrievers, messages = await wait_for_sources(sources)
+    if not live_retrievers:
+        return "\n".join(messages) or "No knowledge bases are loaded."
+    # Snapshot the retrievers being served so a hot reload mid-query doesn't mix versions
+    retrievers = {name: live.retriever for name, live in live_retrievers.items()}
+    filters = {"title_prefix": title_prefix}
+
+    def search() -> str:
+        from src.retrieval_stuff.retriever import normalize_query, filter_key
+        if pager is None:
+            return "\n".join(messages + federated_search.retrieve(retrievers, query, rerank=rerank, filters=filters))
+        versions = tuple((name, retriever.index.version, retriever.index.revision) for name, retriever in retrievers.items())
+        return "\n".join(messages + [first_page(
+            ("search_all", versions, normalize_query(query), rerank, filter_key(filters)),
+            federated_search.retrieve(retrievers, query, rerank=rerank, filters=filters),
+            lambda: federated_search.search(retrievers, query, rerank=rerank, top_k=max_results, filters=filters),
+            lambda results: federated_search.format(retrievers, results, query),
+            "search_all")])
+    return await run_search(search, ctx, "search_all")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--confluence", action="store_true", help="Use confluence as a knowledge base")
-    parser.add_argument("--confluence_path", type=str, default="index/confluence_pages_index", help="Path to the confluence index")
-    parser.add_argument("--guidebook", action="store_true", help="Use the engineering guidebook as a knowledge base")
-    parser.add_argument("--guidebook_path", type=str, default="index/eng_handbook_index", help="Path to the guidebook index")
+    parser.add_argument("--sources", type=str, default=DEFAULT_SOURCES_FILE, help="Source registry listing the knowledge bases to serve")
+    parser.add_argument("--source", action="append", default=None, help="Only serve this knowledge base from the registry (repeatable; default: all of them)")
+    parser.add_argument("--transport", type=str, default="stdio", choices=["stdio", "streamable-http", "sse"], help="stdio for one client per process, streamable-http or sse for one shared server many clients connect to")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address the HTTP transports listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port the HTTP transports listen on")
+    parser.add_argument("--mmap", action="store_true", help="Memory-map the stored vectors instead of reading them into memory")
     parser.add_argument("--top_k", type=int, default=10, help="Number of results to return")
+    parser.add_argument("--hybrid", action="store_true", help="Combine vector search with BM25 keyword search")
+    parser.add_argument("--direct", action="store_true", help="Serve plain vector search straight from FAISS, skipping the LlamaIndex retriever")
+    parser.add_argument("--rerank", action="store_true", help="Rerank results with a local cross-encoder")
+    parser.add_argument("--rerank_model", type=str, default="cross-encoder/ms-marco-MiniLM-L-6-v2", help="Cross-encoder used with --rerank")
+    parser.add_argument("--rerank_pool", type=int, default=30, help="Number of candidates the cross-encoder reranks")
+    parser.add_argument("--rerank_budget_ms", type=float, default=200.0, help="Max reranking time per query before falling back to vector order")
+    parser.add_argument("--mmr_lambda", type=float, default=None, help="Pick results by maximal marginal relevance with this relevance/novelty trade-off (e.g. 0.7)")
+    parser.add_argument("--max_per_document", type=int, default=None, help="Max chunks of a single page/file in the results")
+    parser.add_argument("--context_window", type=int, default=0, help="Return each result with this many neighbouring chunks of its page on either side")
+    parser.add_argument("--max_response_tokens", type=int, default=4000, help="Approximate token budget per tool response; long results are cut down to their most relevant sentences (0 to disable)")
+    parser.add_argument("--semantic_cache_path", type=str, default="index/query_cache.sqlite", help="File to persist results of past queries in, so similar queries skip the search after a restart (empty to disable)")
+    parser.add_argument("--semantic_cache_threshold", type=float, default=0.95, help="Min cosine similarity for a query to reuse an earlier query's results")
+    parser.add_argument("--semantic_cache_ttl_hours", type=float, default=168.0, help="Hours cached results are kept")
+    parser.add_argument("--semantic_cache_size", type=int, default=10000, help="Max number of cached queries")
+    parser.add_argument("--max_results", type=int, default=50, help="Max results a search can page through with cursors, --top_k per page (--top_k or less disables paging)")
+    parser.add_argument("--cursor_ttl", type=float, default=300.0, help="Seconds the ranked results behind a cursor are kept after their last use")
+    parser.add_argument("--max_per_source", type=int, default=None, help="Max results a single knowledge base may contribute to search_all (default: no quota)")
+    parser.add_argument("--search_workers", type=int, default=4, help="Max number of searches running at the same time")
+    parser.add_argument("--max_searches_per_client", type=int, default=2, help="Max number of searches a single client runs at the same time; its other searches wait")
+    parser.add_argument("--embed_batch_wait_ms", type=float, default=3.0, help="Max milliseconds a query embedding waits for concurrent queries to share its forward pass")
+    parser.add_argument("--embed_batch_size", type=int, default=32, help="Max queries embedded in one forward pass")
+    parser.add_argument("--torch_threads", type=int, default=None, help="Threads torch uses per forward pass (default: torch's choice, usually one per core)")
+    parser.add_argument("--search_timeout", type=float, default=30.0, help="Seconds before a search is abandoned and the tool returns a timeout message")
+    parser.add_argument("--warmup_wait", type=float, default=10.0, help="Seconds a search waits for a knowledge base that is still loading before replying that it is warming up")
+    parser.add_argument("--warmup_queries", nargs="*", default=["how do I deploy a service", "on-call runbook", "feature flags"], help="Queries run through each index before it starts serving (none to skip warmup)")
+    parser.add_argument("--offline", action="store_true", help="Only load models from the local cache, never download them")
+    parser.add_argument("--reload_interval", type=float, default=30.0, help="Seconds between checks for a newly published index version (0 to disable)")
+    parser.add_argument("--log_file", type=str, default=None, help="Write diagnostics to this file instead of stderr")
+    parser.add_argument("--log_level", type=str, default="INFO", help="Log level, e.g. DEBUG to log every query")
+    parser.add_argument("--metrics_file", type=str, default=None, help="Periodically write latency metrics to this file in Prometheus text format")
+    parser.add_argument("--metrics_interval", type=float, default=15.0, help="Seconds between writes of --metrics_file")
     args = parser.parse_args()
+    # Never log to stdout, it carries the protocol in stdio mode
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        handlers=[logging.FileHandler(args.log_file) if args.log_file else logging.StreamHandler(sys.stderr)]
+    )
+    if args.direct and args.hybrid:
+        parser.error("--direct and --hybrid can't be combined")
+    embedding_registry.offline = args.offline
+    embedding_registry.configure_batching(args.embed_batch_wait_ms, args.embed_batch_size)
+    default_retriever = "hybrid" if args.hybrid else "direct" if args.direct else "vector"
+    try:
+        registry = load_sources(args.sources)
+    except (OSError, ValueError, TypeError) as e:
+        parser.error(f"Could not read the source registry: {e}")
+    if args.source:
+        unknown = set(args.source) - {source.name for source in registry}
+        if unknown:
+            parser.error(f"Unknown sources: {', '.join(sorted(unknown))}")
+        registry = [source for source in registry if source.name in args.source]
+    if not registry:
+        parser.error(f"No sources to serve in {args.sources}")
+    rerank = args.rerank
+
+    def setup_retrieval() -> dict:
+        """
+        Import the search stack and create what every knowledge base shares: the retriever
+        classes and the semantic cache, response builder and reranker passed to each retriever.
+        """
+        global federated_search, document_chars
+        from src.retrieval_stuff.retriever import HuggingFaceVectorRetriever, HybridRetriever
+        from src.retrieval_stuff.direct import DirectRetriever
+        from src.retrieval_stuff.federated import FederatedSearch
+        from src.retrieval_stuff.response import ResponseBuilder, CHARS_PER_TOKEN
+        from src.retrieval_stuff.embedding import set_torch_threads
+
+        if args.torch_threads:
+            logger.info(f"Running forward passes on {args.torch_threads} torch threads each.")
+            set_torch_threads(args.torch_threads)
+        retriever_kwargs = {
+            "mmr_lambda": args.mmr_lambda,
+            "max_per_document": args.max_per_document,
+            "context_window": args.context_window
+        }
+        if args.semantic_cache_path:
+            from src.retrieval_stuff.semantic_cache import SemanticQueryCache
+            # One cache file for every index; entries are tagged with the index they came from
+            retriever_kwargs["semantic_cache"] = SemanticQueryCache(
+                args.semantic_cache_path,
+                threshold=args.semantic_cache_threshold,
+                ttl_seconds=args.semantic_cache_ttl_hours * 3600,
+                max_entries=args.semantic_cache_size
+            )
+        if args.max_response_tokens > 0:
+            retriever_kwargs["response_builder"] = ResponseBuilder(max_tokens=args.max_response_tokens)
+            document_chars = args.max_response_tokens * CHARS_PER_TOKEN
+        if args.rerank:
+            from src.retrieval_stuff.rerank import CrossEncoderReranker
+            # One reranker shared by every index, so its model and pair cache are loaded once
+            retriever_kwargs["reranker"] = CrossEncoderReranker(
+                model_name=args.rerank_model,
+                candidate_pool=args.rerank_pool,
+                latency_budget_ms=args.rerank_budget_ms,
+                offline=args.offline
+            )
+        federated_search = FederatedSearch(top_k=args.top_k, max_per_source=args.max_per_source)
+        return {
+            "retriever_classes": {"vector": HuggingFaceVectorRetriever, "hybrid": HybridRetriever, "direct": DirectRetriever},
+            "retriever_kwargs": retriever_kwargs
+        }
+
+    # Indexes and models load in the background, in parallel, so the server answers the
+    # client's handshake straight away; searches wait for the knowledge base they need.
+    loader = BackgroundLoader()
+    warmup_wait = args.warmup_wait
+    # Started first, so the knowledge bases waiting on it never hold every loader thread without it
+    retrieval_load = setup_retrieval
+    loader.start("retrieval", retrieval_load)
+
+    def load_source(source: SourceConfig):
+        def load() -> "LiveRetriever":
+            from src.retrieval_stuff.live_index import LiveRetriever
+            shared = loader.future("retrieval").result()
+            retriever = LiveRetriever(
+                index_name=source.name,
+                path=source.index_path,
+                top_k=args.top_k,
+                retriever_cls=shared["retriever_classes"][source.retriever or default_retriever],
+                mmap=args.mmap,
+                warmup_queries=args.warmup_queries,
+                hf_name=source.model,
+                **shared["retriever_kwargs"]
+            )
+            if args.reload_interval > 0:
+                retriever.watch(args.reload_interval)
+            return retriever
+        return load
+
+    # Lazy sources cost nothing until they're first searched, so a long registry doesn't slow the start
+    for source in registry:
+        sources.append(source.name)
+        source_loads[source.name] = load_source(source)
+        register_search_tool(source)
+        if source.load == "background":
+            loader.start(source.name, source_loads[source.name])
+    if args.rerank:
+        loader.start("reranker", lambda: loader.future("retrieval").result()["retriever_kwargs"]["reranker"].load())
+
+    if args.max_results > args.top_k:
+        pager = ResultPager(page_size=args.top_k, ttl_seconds=args.cursor_ttl)
+        max_results = args.max_results
+    search_executor = ThreadPoolExecutor(max_workers=args.search_workers, thread_name_prefix="search")
+    search_timeout = args.search_timeout
+    max_pending_searches = 4 * args.search_workers
+    max_searches_per_client = args.max_searches_per_client
+
+    if args.metrics_file:
+        def write_metrics():
+            while True:
+                try:
+                    metrics.write_prometheus(args.metrics_file)
+                except OSError as e:
+                    logger.error(f"Error writing metrics to {args.metrics_file}: {e}")
+                time.sleep(args.metrics_interval)
+        threading.Thread(target=write_metrics, name="metrics-writer", daemon=True).start()
 
-    if args.confluence:
-        print("Loading confluence index...")
-        confluence_index = HuggingFaceVectorStoreIndex(
-            index_name="confluence_pages_index",
-            path=args.confluence_path
-        )
-        confluence_index.load()
-        confluence_retriever = HuggingFaceVectorRetriever(confluence_index, top_k=args.top_k)
-
-    if args.guidebook:
-        print("Loading guidebook index...")
-        guidebook_index = HuggingFaceVectorStoreIndex(
-            index_name="eng_handbook_index",
-            path=args.guidebook_path
-        )
-        guidebook_index.load()
-        guidebook_retriever = HuggingFaceVectorRetriever(guidebook_index, top_k=args.top_k)
-    
-    print("Starting MCP server...")
-    mcp.run(transport='stdio')
\ No newline at end of file
+    logger.info(f"Starting MCP server ({args.transport})...")
+    if args.transport != "stdio":
+        # One process serves every client: they share the loaded models, indexes and caches
+        mcp.settings.host = args.host
+        mcp.settings.port = args.port
+        logger.info(f"Listening on http://{args.host}:{args.port}{mcp.settings.streamable_http_path if args.transport == 'streamable-http' else mcp.settings.sse_path}")
+    mcp.run(transport=args.transport)
\ No newline at end of file
@@ -1,4 +1,5 @@
 import argparse
+import logging
 from document_parser import ConfluenceDocumentParser
 from src.retrieval_stuff.index import HuggingFaceVectorStoreIndex
 from confluence_scraper import ConfluenceScraper
@@ -19,6 +20,7 @@ def main():
     parser.add_argument("--env_path", type=str, required=True, help="Path to the .env file")
 
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     print("Downloading all pages from the following spaces:", args.confluence_spaces)
 
     dotenv.load_dotenv(dotenv_path=args.env_path, override=True)
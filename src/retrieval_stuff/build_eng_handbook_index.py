@@ -1,4 +1,5 @@
 import argparse
+import logging
 from document_parser import EngHandbookDocumentParser
 from src.retrieval_stuff.index import HuggingFaceVectorStoreIndex
 
@@ -15,6 +16,7 @@ def main():
     parser.add_argument("--dimension", type=int, required=True)
     parser.add_argument("--index_path", default="./index/eng_handbook_index", type=str, required=False)
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     
     parser = EngHandbookDocumentParser(
         dir_path=args.handbook_path,
@@ -145,6 +145,8 @@ class ConfluenceScraper:
                 if not page_data:
                     failed_pages.append(page["id"])
                     continue
+                page_data["id"] = page["id"]
+                page_data["space"] = space
                 
                 # Download the page
                 try:
@@ -175,6 +177,8 @@ def main(args):
             if not page_data:
                 failed_pages.append(page["id"])
                 continue
+            page_data["id"] = page["id"]
+            page_data["space"] = space
             
             # Download the page
             try:
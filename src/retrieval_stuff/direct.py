@@ -0,0 +1,173 @@
+from src.retrieval_stuff.index import HuggingFaceVectorStoreIndex, get_document_id
+from src.retrieval_stuff.retriever import HuggingFaceVectorRetriever, normalize_query, filter_key
+from src.retrieval_stuff.response import RESULT_TEMPLATE
+from src.retrieval_stuff.metrics import metrics
+from llama_index.core.schema import NodeWithScore, TextNode
+import numpy as np
+import threading
+
+
+class StringTable:
+    """
+    Strings packed into one UTF-8 buffer with an offsets array, so a large table costs two arrays
+    rather than one Python object per string.
+    """
+    def __init__(self, strings: list[str]):
+        encoded = [string.encode("utf-8") for string in strings]
+        self._offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=self._offsets[1:])
+        self._data = b"".join(encoded)
+
+
+    def __getitem__(self, row: int) -> str:
+        return self._data[self._offsets[row]: self._offsets[row + 1]].decode("utf-8")
+
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+
+class ResultTable:
+    """
+    Everything needed to format a search hit, addressed directly by vector id.
+    """
+    def __init__(self, index: HuggingFaceVectorStoreIndex):
+        self.version = index.version
+        self.revision = index.revision
+        vector_ids, node_ids, texts, file_paths, titles, doc_ids = [], [], [], [], [], []
+        for vector_id, node_id in index.index.index_struct.nodes_dict.items():
+            node = index.index.docstore.get_node(node_id, raise_error=False)
+            if node is None:
+                continue
+            vector_ids.append(int(vector_id))
+            node_ids.append(node_id)
+            texts.append(node.text)
+            file_paths.append(node.metadata.get("file_path", "Unknown"))
+            titles.append(node.metadata.get("title", "Unknown"))
+            doc_ids.append(get_document_id(node))
+
+        # vector id -> row, -1 for ids that aren't in the table
+        self.rows = np.full(max(vector_ids, default=-1) + 1, -1, dtype=np.int32)
+        self.rows[vector_ids] = np.arange(len(vector_ids), dtype=np.int32)
+        self.node_ids = StringTable(node_ids)
+        self.texts = StringTable(texts)
+        self.file_paths = StringTable(file_paths)
+        self.titles = StringTable(titles)
+        self.doc_ids = StringTable(doc_ids)
+
+
+    def lookup(self, vector_ids: np.ndarray, dists: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Rows of the hits of one FAISS search and their scores, as cosine similarities.
+        """
+        valid = (vector_ids >= 0) & (vector_ids < len(self.rows))
+        rows = self.rows[vector_ids[valid]]
+        found = rows >= 0
+        # Same conversion from squared L2 distance as HuggingFaceVectorRetriever
+        return rows[found], 1.0 - dists[valid][found] / 2.0
+
+
+    def format(self, row: int) -> str:
+        return RESULT_TEMPLATE.format(self.file_paths[row], self.titles[row], self.doc_ids[row], self.texts[row])
+
+
+    def node(self, row: int, score: float) -> NodeWithScore:
+        """
+        A lightweight node with just what formatting a result needs, e.g. for the response builder.
+        """
+        metadata = {"file_path": self.file_paths[row], "title": self.titles[row], "doc_id": self.doc_ids[row]}
+        return NodeWithScore(node=TextNode(id_=self.node_ids[row], text=self.texts[row], metadata=metadata), score=float(score))
+
+
+class DirectRetriever(HuggingFaceVectorRetriever):
+    """
+    Plain vector search served straight from the embedding model, the FAISS index and a packed result table.
+
+    Skips the LlamaIndex retriever stack (query bundles, callbacks, docstore lookups, node objects)
+    on the hot path. Output is identical to HuggingFaceVectorRetriever. With a response builder only the
+    final results are turned into lightweight nodes for it. Reranking, diversity selection and context
+    expansion work on the whole candidate pool, so queries using them go through the regular path.
+    """
+    def __init__(self, index: HuggingFaceVectorStoreIndex, top_k: int = 10, **kwargs):
+        super().__init__(index, top_k=top_k, **kwargs)
+        self._table = None
+        self._table_lock = threading.Lock()
+
+
+    def _get_table(self) -> ResultTable:
+        # Rebuilt after upserts/deletes; queries in flight keep the table they started with
+        table = self._table
+        if table is None or (table.version, table.revision) != (self.index.version, self.index.revision):
+            with self._table_lock:
+                table = self._table
+                if table is None or (table.version, table.revision) != (self.index.version, self.index.revision):
+                    table = self._table = ResultTable(self.index)
+        return table
+
+
+    def warm_up(self, queries: list[str], rerank: bool = False) -> dict[str, float]:
+        # Build the result table up front as well, instead of on the first query
+        self._get_table()
+        return super().warm_up(queries, rerank=rerank)
+
+
+    def _needs_nodes(self, rerank: bool) -> bool:
+        return rerank or self.mmr_lambda is not None or self.max_per_document is not None or self.context_window > 0
+
+
+    def _search_rows(self, normalized_queries: list[str], top_k: int = None,
+                     filters: dict[str, str] | None = None) -> tuple[ResultTable, list[tuple[np.ndarray, np.ndarray]]]:
+        """
+        Search FAISS for several queries; returns the result table and the top_k (rows, scores) of each query.
+        """
+        allowed_ids = self._allowed_ids(filters)
+        table = self._get_table()
+        embeddings = np.array(self.embed_queries(normalized_queries), dtype="float32")
+        if allowed_ids is not None and len(allowed_ids) == 0:
+            ids = np.full((len(normalized_queries), 0), -1, dtype=np.int64)
+            dists = np.zeros((len(normalized_queries), 0), dtype=np.float32)
+        else:
+            dists, ids = self.index.index.vector_store.search(embeddings, max(self.top_k, top_k or 0), allowed_ids)
+        hits = []
+        for query_ids, query_dists in zip(ids, dists):
+            rows, scores = table.lookup(query_ids, query_dists)
+            hits.append((rows[: top_k], scores[: top_k]))
+        return table, hits
+
+
+    def retrieve_scored(self, query: str, rerank: bool = False, top_k: int = None,
+                        filters: dict[str, str] | None = None) -> tuple[list[NodeWithScore], str]:
+        if self._needs_nodes(rerank):
+            return super().retrieve_scored(query, rerank=rerank, top_k=top_k, filters=filters)
+        table, hits = self._search_rows([normalize_query(query)], top_k, filters)
+        rows, scores = hits[0]
+        return [table.node(row, score) for row, score in zip(rows, scores)], self.score_kind_for(rerank)
+
+
+    def retrieve(self, query: str, rerank: bool = False, top_k: int = None, filters: dict[str, str] | None = None) -> list[str]:
+        if self._needs_nodes(rerank):
+            return super().retrieve(query, rerank=rerank, top_k=top_k, filters=filters)
+        return self.retrieve_many([query], top_k=top_k, filters=filters)[0]
+
+
+    def retrieve_many(self, queries: list[str], rerank: bool = False, top_k: int = None,
+                      filters: dict[str, str] | None = None) -> list[list[str]]:
+        if self._needs_nodes(rerank):
+            return super().retrieve_many(queries, rerank=rerank, top_k=top_k, filters=filters)
+
+        normalized_queries = [normalize_query(query) for query in queries]
+        cache_keys = [(normalized, top_k, False, filter_key(filters), self.index.version, self.index.content_id)
+                      for normalized in normalized_queries]
+        results = [self._get_cached(cache_key) for cache_key in cache_keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            table, hits = self._search_rows([normalized_queries[i] for i in missing], top_k, filters)
+            for i, (rows, scores) in zip(missing, hits):
+                with metrics.timer("format"):
+                    if self.response_builder is None:
+                        results[i] = tuple(table.format(row) for row in rows)
+                    else:
+                        nodes = [table.node(row, score) for row, score in zip(rows, scores)]
+                        results[i] = tuple(self._format_results(nodes, normalized_queries[i]))
+                self._put_cached(cache_keys[i], results[i])
+        return [list(result) for result in results]
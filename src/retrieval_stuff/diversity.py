@@ -0,0 +1,57 @@
+from src.retrieval_stuff.index import get_document_id
+from llama_index.core.schema import NodeWithScore
+import numpy as np
+
+
+def select_diverse(nodes: list[NodeWithScore], vectors: np.ndarray | None, top_k: int,
+                   mmr_lambda: float | None = None, max_per_document: int | None = None) -> list[NodeWithScore]:
+    """
+    Pick top_k of the ranked candidates so they cover more distinct pages.
+
+    Args:
+        nodes: Candidates, best first.
+        vectors: Stored vectors of the candidates, one row per node. Only needed for MMR.
+        mmr_lambda: Maximal marginal relevance trade-off between relevance (1.0) and novelty (0.0).
+            None keeps the ranked order.
+        max_per_document: Max chunks of one source document in the result.
+
+    Relevance is the candidate's score scaled to [0, 1], so MMR works the same on vector, fused and
+    reranked scores. Novelty is the cosine similarity to the closest chunk already picked.
+    """
+    if mmr_lambda is None or vectors is None or len(nodes) <= 1:
+        order = range(len(nodes))
+    else:
+        order = _mmr_order(nodes, vectors, mmr_lambda)
+
+    selected, per_document = [], {}
+    for i in order:
+        doc_id = get_document_id(nodes[i].node)
+        if max_per_document is not None and per_document.get(doc_id, 0) >= max_per_document:
+            continue
+        per_document[doc_id] = per_document.get(doc_id, 0) + 1
+        selected.append(nodes[i])
+        if len(selected) == top_k:
+            break
+    return selected
+
+
+def _mmr_order(nodes: list[NodeWithScore], vectors: np.ndarray, mmr_lambda: float) -> list[int]:
+    scores = np.array([node.score or 0.0 for node in nodes], dtype=np.float32)
+    spread = scores.max() - scores.min()
+    relevance = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarities = vectors @ vectors.T
+
+    order = [int(np.argmax(relevance))]
+    max_similarity = similarities[order[0]].copy()
+    remaining = np.ones(len(nodes), dtype=bool)
+    remaining[order[0]] = False
+    while remaining.any():
+        mmr = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        mmr[~remaining] = -np.inf
+        best = int(np.argmax(mmr))
+        order.append(best)
+        remaining[best] = False
+        np.maximum(max_similarity, similarities[best], out=max_similarity)
+    return order
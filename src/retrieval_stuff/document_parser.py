@@ -11,6 +11,8 @@ def chunk_document(doc: Document, char_limit: int) -> list[Document]:
 
     text = doc.text
     metadata = doc.metadata.copy()  # Preserve original metadata
+    # Stable id of the source page/file, used to upsert and delete all of its chunks together
+    metadata.setdefault('doc_id', metadata.get('file_path') or metadata.get('title') or doc.doc_id)
     
     # Split text into sentences using regex
     sentences = re.split(sentence_pattern, text)
@@ -52,7 +54,9 @@ def chunk_document(doc: Document, char_limit: int) -> list[Document]:
         # Create new Document with chunked text and preserved metadata
         chunk_doc = Document(
             text=chunk_text,
-            metadata=chunk_metadata
+            metadata=chunk_metadata,
+            excluded_embed_metadata_keys=['doc_id', 'space', 'subdirectory'],
+            excluded_llm_metadata_keys=['doc_id', 'space', 'subdirectory']
         )
         result_documents.append(chunk_doc)
 
@@ -112,6 +116,10 @@ class EngHandbookDocumentParser(DocumentParser):
         print(f"Getting documents from {self.dir_path}...")
         documents = self.read_documents()
         print(f"Found {len(documents)} documents.")
+        for doc in documents:
+            # Directory relative to the handbook root, used to filter searches
+            subdirectory = os.path.relpath(os.path.dirname(doc.metadata.get("file_path", "")), self.dir_path)
+            doc.metadata["subdirectory"] = "" if subdirectory == "." else subdirectory.replace(os.sep, "/")
         
         print(f"Chunking {len(documents)} documents...")
         chunked_documents = []
@@ -150,7 +158,11 @@ class ConfluenceDocumentParser(DocumentParser):
                 if file.endswith(".json"):
                     file_path = os.path.join(root, file)
                     with open(file_path, "r") as f:
-                        json_documents.append(json.load(f))
+                        document = json.load(f)
+                    # Pages are downloaded into one directory per space
+                    if root != self.dir_path:
+                        document.setdefault("space", os.path.relpath(root, self.dir_path).split(os.sep)[0])
+                    json_documents.append(document)
         
         return json_documents
     
@@ -191,8 +203,10 @@ class ConfluenceDocumentParser(DocumentParser):
         """
         doc = Document(text=document["clean_text"])
         doc.metadata = {
+            "doc_id": f"confluence:{document.get('id', document['title'])}",
             "title": document["title"],
-            "word_count": document["word_count"]
+            "word_count": document["word_count"],
+            "space": document.get("space", "")
         }
         return doc
 
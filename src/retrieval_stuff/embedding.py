@@ -0,0 +1,255 @@
+from __future__ import annotations
+from src.retrieval_stuff.metrics import metrics
+from typing import TYPE_CHECKING
+import threading
+import time
+import logging
+
+# LlamaIndex and the HuggingFace stack take seconds to import; they're only imported when a model is loaded
+if TYPE_CHECKING:
+    from llama_index.core.base.embeddings.base import BaseEmbedding
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingModelRegistry:
+    """
+    Process-wide, reference counted cache of embedding models.
+
+    Indexes built on the same model share a single instance instead of each loading their own copy,
+    and nothing is written to the global LlamaIndex `Settings`, so loading two indexes concurrently
+    can't leave one of them with the other's model.
+    """
+    def __init__(self):
+        self._models: dict[tuple[str, str], BaseEmbedding] = {}
+        self._ref_counts: dict[tuple[str, str], int] = {}
+        self._load_locks: dict[tuple[str, str], threading.Lock] = {}
+        self._batchers: dict[tuple[str, str], QueryBatcher] = {}
+        self._lock = threading.Lock()
+        self.batch_wait_ms = 3.0
+        self.max_batch_size = 32
+        # Refuse to download models that aren't cached instead of fetching them from the Hub
+        self.offline = False
+
+
+    def acquire(self, model_name: str, backend: str = "torch") -> BaseEmbedding:
+        """
+        Get the shared instance of a model, loading it on first use.
+
+        Args:
+            model_name: HuggingFace model name or local path.
+            backend: sentence-transformers backend to run the model on ("torch", "onnx" or "openvino").
+        """
+        key = (model_name, backend)
+        with self._lock:
+            self._ref_counts[key] = self._ref_counts.get(key, 0) + 1
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so different models can load in parallel,
+        # while concurrent requests for the same model wait for a single load.
+        with load_lock:
+            if key not in self._models:
+                logger.info(f"Loading embedding model {model_name} ({backend})...")
+                from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+                model = load_cached_model(HuggingFaceEmbedding, model_name, offline=self.offline, backend=backend)
+                with self._lock:
+                    self._models[key] = model
+                    self._batchers[key] = QueryBatcher(model, self.batch_wait_ms, self.max_batch_size)
+            return self._models[key]
+
+
+    def release(self, model_name: str, backend: str = "torch"):
+        """
+        Drop a reference to a model, unloading it once nothing uses it anymore.
+        """
+        key = (model_name, backend)
+        with self._lock:
+            if key not in self._ref_counts:
+                return
+            self._ref_counts[key] -= 1
+            if self._ref_counts[key] <= 0:
+                del self._ref_counts[key]
+                self._models.pop(key, None)
+                self._batchers.pop(key, None)
+                logger.info(f"Unloaded embedding model {model_name} ({backend}).")
+
+
+    def loaded_models(self) -> dict[tuple[str, str], int]:
+        with self._lock:
+            return dict(self._ref_counts)
+
+
+    def get_batcher(self, embed_model: BaseEmbedding) -> "QueryBatcher | None":
+        """
+        The query batcher of a model loaded through the registry, None for other models.
+        """
+        with self._lock:
+            for batcher in self._batchers.values():
+                if batcher.embed_model is embed_model:
+                    return batcher
+        return None
+
+
+    def configure_batching(self, batch_wait_ms: float, max_batch_size: int):
+        """
+        Set the batching window and size of query embeddings, for models loaded from now on.
+        """
+        self.batch_wait_ms = batch_wait_ms
+        self.max_batch_size = max_batch_size
+
+
+
+class QueryBatcher:
+    """
+    Runs query embeddings requested concurrently from different threads as one batch.
+
+    There is no worker thread: the first caller to find the model idle runs the batch for everyone
+    queued at that point, the others wait for their results. While a batch runs, new queries pile up
+    and go together in the next one. Under load the caller running a batch also waits up to
+    batch_wait_ms for more queries to join; a query arriving on an idle server runs straight away,
+    so batching never adds latency to a lone query.
+    """
+    def __init__(self, embed_model: BaseEmbedding, batch_wait_ms: float = 3.0, max_batch_size: int = 32):
+        """
+        Args:
+            embed_model: Model to embed the queries with.
+            batch_wait_ms: Max time to wait for more queries before running a batch, when queries are
+                arriving less than this far apart.
+            max_batch_size: Max queries per forward pass.
+        """
+        self.embed_model = embed_model
+        self.batch_wait = batch_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.batched_queries = 0
+        self._queue: list[dict] = []
+        self._queued = 0
+        self._running = False
+        self._last_arrival = 0.0
+        self._condition = threading.Condition()
+
+
+    def embed(self, queries: list[str]) -> list[list[float]]:
+        request = {"queries": list(queries), "embeddings": None, "error": None}
+        with self._condition:
+            now = time.perf_counter()
+            busy = now - self._last_arrival < self.batch_wait
+            self._last_arrival = now
+            self._queue.append(request)
+            self._queued += len(queries)
+            self._condition.notify_all()
+            while True:
+                if request["embeddings"] is not None:
+                    return request["embeddings"]
+                if request["error"] is not None:
+                    raise request["error"]
+                if not self._running:
+                    self._running = True
+                    break
+                self._condition.wait()
+
+        # This caller runs batches until its own query is done, then hands over to the next waiting caller
+        try:
+            while request["embeddings"] is None and request["error"] is None:
+                self._run_batch(busy)
+                busy = True
+        finally:
+            with self._condition:
+                self._running = False
+                self._condition.notify_all()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["embeddings"]
+
+
+    def _run_batch(self, wait: bool):
+        with self._condition:
+            if wait:
+                deadline = time.perf_counter() + self.batch_wait
+                while self._queued < self.max_batch_size and (remaining := deadline - time.perf_counter()) > 0:
+                    self._condition.wait(remaining)
+            batch, size = [], 0
+            while self._queue and (not batch or size + len(self._queue[0]["queries"]) <= self.max_batch_size):
+                request = self._queue.pop(0)
+                batch.append(request)
+                size += len(request["queries"])
+            self._queued -= size
+
+        try:
+            embeddings = self.embed_model._embed([query for request in batch for query in request["queries"]], prompt_name="query")
+        except Exception as e:
+            with self._condition:
+                for request in batch:
+                    request["error"] = e
+                self._condition.notify_all()
+            return
+
+        with self._condition:
+            self.batches += 1
+            self.batched_queries += size
+            metrics.increment("embed_batches")
+            offset = 0
+            for request in batch:
+                request["embeddings"] = embeddings[offset: offset + len(request["queries"])]
+                offset += len(request["queries"])
+            self._condition.notify_all()
+
+
+
+def load_cached_model(load, model_name: str, offline: bool = False, **kwargs):
+    """
+    Load a HuggingFace model strictly from the local cache, so startup never waits on the Hub.
+
+    A model that isn't cached yet is downloaded once, unless offline is set.
+
+    Args:
+        load: Model class taking the model name and a local_files_only flag, e.g. HuggingFaceEmbedding or CrossEncoder.
+        kwargs: Extra arguments for load.
+    """
+    try:
+        return load(model_name, local_files_only=True, **kwargs)
+    except OSError as e:
+        if offline:
+            raise ValueError(f"Model {model_name} is not in the local cache. Run once without offline mode to download it.") from e
+        logger.warning(f"Model {model_name} is not cached yet, downloading it...")
+        return load(model_name, **kwargs)
+
+
+
+def embed_queries(embed_model: BaseEmbedding, queries: list[str]) -> list[list[float]]:
+    """
+    Embed several queries in one forward pass.
+
+    LlamaIndex only exposes single-query embedding, which would run the model once per query,
+    so for HuggingFace models this calls the batched encode with the query prompt directly.
+    Models loaded through the registry also share the forward pass with queries embedded
+    concurrently by other threads.
+    """
+    if not queries:
+        return []
+    metrics.increment("embedded_queries", len(queries))
+    with metrics.timer("embed"):
+        batcher = embedding_registry.get_batcher(embed_model)
+        if batcher is not None:
+            return batcher.embed(queries)
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        if isinstance(embed_model, HuggingFaceEmbedding):
+            return embed_model._embed(list(queries), prompt_name="query")
+        return [embed_model.get_query_embedding(query) for query in queries]
+
+
+
+def set_torch_threads(num_threads: int):
+    """
+    Set the number of threads torch uses within a single forward pass, for the whole process.
+
+    Query embeddings run one batch per model at a time, so a lone query gets every thread; only
+    snippet sentences and the reranker can run forward passes side by side with it. Lowering the
+    count trades single-query latency for less contention under load.
+    """
+    import torch
+    torch.set_num_threads(num_threads)
+
+
+
+embedding_registry = EmbeddingModelRegistry()
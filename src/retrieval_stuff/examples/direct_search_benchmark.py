@@ -0,0 +1,71 @@
+import argparse
+import time
+import numpy as np
+
+from src.retrieval_stuff.index import HuggingFaceVectorStoreIndex
+from src.retrieval_stuff.retriever import HuggingFaceVectorRetriever
+from src.retrieval_stuff.direct import DirectRetriever
+from src.retrieval_stuff.response import ResponseBuilder
+
+
+def time_queries(retriever: HuggingFaceVectorRetriever, queries: list[str], repeats: int) -> np.ndarray:
+    """
+    Per-query latency in milliseconds with the query embeddings already cached, so only
+    search and result assembly are measured.
+    """
+    for query in queries:
+        retriever.retrieve(query)
+
+    timings = []
+    for _ in range(repeats):
+        for query in queries:
+            retriever.result_cache.clear()
+            start = time.perf_counter()
+            retriever.retrieve(query)
+            timings.append((time.perf_counter() - start) * 1000)
+    return np.array(timings)
+
+
+def main():
+    """
+    Example usage:
+    python src/retrieval_stuff/examples/direct_search_benchmark.py --index_path index/confluence_pages_index --queries "how do I deploy" "on-call runbook"
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index_path", type=str, required=True, help="Path to the index to benchmark")
+    parser.add_argument("--queries", nargs="+", default=["how do I deploy a service", "on-call runbook", "feature flags"])
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=50, help="Times each query is run")
+    parser.add_argument("--max_response_tokens", type=int, default=4000, help="Response budget, as in the server (0 to disable)")
+    args = parser.parse_args()
+
+    index = HuggingFaceVectorStoreIndex(index_name="direct_search_benchmark", path=args.index_path)
+    index.load()
+    if index.index is None:
+        raise ValueError(f"No index found at {args.index_path}.")
+
+    # Same response budget as the server, so the benchmark measures what the server runs
+    response_builder = ResponseBuilder(max_tokens=args.max_response_tokens) if args.max_response_tokens > 0 else None
+    current = HuggingFaceVectorRetriever(index, top_k=args.top_k, response_builder=response_builder)
+    direct = DirectRetriever(index, top_k=args.top_k, response_builder=response_builder)
+
+    start = time.perf_counter()
+    direct._get_table()
+    print(f"Built result table for {index.index.vector_store.client.ntotal} vectors in {time.perf_counter() - start:.2f}s.")
+
+    for query in args.queries:
+        if current.retrieve(query) != direct.retrieve(query):
+            print(f"Warning: results differ for query '{query}'.")
+
+    print(f"\n{'path':<10} {'p50':>8} {'p95':>8} {'mean':>8}")
+    results = {}
+    for name, retriever in (("current", current), ("direct", direct)):
+        timings = time_queries(retriever, args.queries, args.repeats)
+        results[name] = timings
+        print(f"{name:<10} {np.percentile(timings, 50):>6.2f}ms {np.percentile(timings, 95):>6.2f}ms {timings.mean():>6.2f}ms")
+    print(f"\nDirect search saves {results['current'].mean() - results['direct'].mean():.2f}ms per query "
+          f"({1 - results['direct'].mean() / results['current'].mean():.0%}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+# Reply of a search made before its knowledge base has loaded
+WARMING_UP = "is still warming up"
+# Replies of a search that didn't answer the query; timing them would pass a broken start
+FAILURES = ("failed to load", "is not loaded", "No knowledge bases are loaded", "Search timed out", "The search server is busy")
+
+
+def time_import(module: str) -> float:
+    """
+    Seconds a fresh interpreter takes to import a module.
+    """
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+async def time_startup(server_args: list[str], tool: str, query: str, timeout: float) -> tuple[float, float]:
+    """
+    Start the server over stdio and time, from the moment it is spawned, the MCP handshake and the first
+    search answered with results rather than a warming up message.
+
+    Raises:
+        RuntimeError: If the search reports an error instead, e.g. an index that failed to load.
+
+    Returns:
+        Seconds to the handshake and seconds to the first answered query.
+    """
+    params = StdioServerParameters(
+        command=sys.executable,
+        args=[os.path.join(ROOT, "src", "mcp_server", "main.py"), *server_args],
+        env={**os.environ, "PYTHONPATH": ROOT},
+        cwd=ROOT
+    )
+    start = time.perf_counter()
+    async with stdio_client(params) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            handshake = time.perf_counter() - start
+            while True:
+                result = await session.call_tool(tool, {"query": query})
+                text = "\n".join(content.text for content in result.content if content.type == "text")
+                if WARMING_UP not in text:
+                    break
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError(f"{tool} was still warming up after {timeout:.0f}s.")
+            first_query = time.perf_counter() - start
+    if result.isError or any(failure in text for failure in FAILURES):
+        raise RuntimeError(f"{tool} didn't answer the query: {text[:500]}")
+    return handshake, first_query
+
+
+def main():
+    """
+    Example usage:
+    python src/retrieval_stuff/examples/startup_benchmark.py --tool search_confluence --max_handshake_ms 1000 -- --sources sources.json --top_k 5
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("server_args", nargs="*", help="Arguments passed to the server (after --)")
+    parser.add_argument("--tool", type=str, default="search_confluence", help="Search tool used for the first query")
+    parser.add_argument("--query", type=str, default="how do I deploy a service")
+    parser.add_argument("--runs", type=int, default=3, help="Number of cold starts measured")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Seconds to wait for the first answered query")
+    parser.add_argument("--max_import_ms", type=float, default=None, help="Fail if the median import time is above this")
+    parser.add_argument("--max_handshake_ms", type=float, default=None, help="Fail if the median time to the handshake is above this")
+    parser.add_argument("--max_first_query_ms", type=float, default=None, help="Fail if the median time to the first answered query is above this")
+    args = parser.parse_args()
+
+    timings = {"import": [], "handshake": [], "first_query": []}
+    for run in range(args.runs):
+        timings["import"].append(time_import("src.mcp_server.main") * 1000)
+        try:
+            handshake, first_query = asyncio.run(time_startup(args.server_args, args.tool, args.query, args.timeout))
+        except (RuntimeError, TimeoutError) as e:
+            print(f"Run {run + 1} failed: {e}")
+            sys.exit(1)
+        timings["handshake"].append(handshake * 1000)
+        timings["first_query"].append(first_query * 1000)
+        print(f"Run {run + 1}: import {timings['import'][-1]:.0f}ms, handshake {timings['handshake'][-1]:.0f}ms, "
+              f"first answered query {timings['first_query'][-1]:.0f}ms")
+
+    failures = []
+    for name, limit in (("import", args.max_import_ms), ("handshake", args.max_handshake_ms), ("first_query", args.max_first_query_ms)):
+        median = float(np.median(timings[name]))
+        print(f"{name}: median {median:.0f}ms, min {min(timings[name]):.0f}ms, max {max(timings[name]):.0f}ms")
+        if limit is not None and median > limit:
+            failures.append(f"{name} median {median:.0f}ms is above the {limit:.0f}ms limit")
+    if failures:
+        print("Startup regression: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
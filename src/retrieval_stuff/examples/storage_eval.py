@@ -0,0 +1,91 @@
+import argparse
+import time
+import numpy as np
+
+from src.retrieval_stuff.index import HuggingFaceVectorStoreIndex
+from src.retrieval_stuff.vector_store import build_faiss_index, index_memory_bytes
+
+
+# (vector_dtype, reduced_dim, reduction)
+STORAGE_OPTIONS = [
+    ("float32", None, "pca"),
+    ("float16", None, "pca"),
+    ("sq8", None, "pca"),
+    ("float32", 192, "pca"),
+    ("float16", 192, "pca"),
+    ("sq8", 128, "pca"),
+    ("float32", 192, "truncate"),
+    ("float16", 128, "truncate"),
+]
+
+
+def evaluate_storage_options(vectors: np.ndarray, queries: np.ndarray, top_k: int = 10):
+    """
+    Compare each storage option against exact float32 search.
+
+    Returns a list of (option, memory in bytes, recall@k, build seconds).
+    """
+    dimension = vectors.shape[1]
+    ids = np.arange(len(vectors), dtype=np.int64)
+
+    exact = build_faiss_index(dimension)
+    exact.add_with_ids(vectors, ids)
+    _, truth = exact.search(queries, top_k)
+
+    results = []
+    for option in STORAGE_OPTIONS:
+        vector_dtype, reduced_dim, reduction = option
+        if reduced_dim and reduced_dim >= dimension:
+            continue
+
+        start = time.time()
+        faiss_index = build_faiss_index(dimension, vector_dtype, reduced_dim, reduction)
+        if not faiss_index.is_trained:
+            faiss_index.train(vectors)
+        faiss_index.add_with_ids(vectors, ids)
+        build_time = time.time() - start
+
+        _, found = faiss_index.search(queries, top_k)
+        recall = np.mean([len(set(t) & set(f)) / top_k for t, f in zip(truth, found)])
+        results.append((option, index_memory_bytes(faiss_index), recall, build_time))
+    return results
+
+
+def main():
+    """
+    Example usage:
+    python src/retrieval_stuff/examples/storage_eval.py --index_path index/confluence_pages_index --queries "how do I deploy" "on-call runbook"
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index_path", type=str, required=True, help="Path to a float32 index")
+    parser.add_argument("--queries", nargs="*", default=[], help="Queries to evaluate with. Defaults to sampled stored vectors.")
+    parser.add_argument("--num_samples", type=int, default=200, help="Number of stored vectors to use as queries")
+    parser.add_argument("--top_k", type=int, default=10)
+    args = parser.parse_args()
+
+    index = HuggingFaceVectorStoreIndex(index_name="storage_eval", path=args.index_path)
+    index.load()
+    if index.vector_dtype != "float32" or index.reduced_dim:
+        raise ValueError("Evaluate against an uncompressed float32 index.")
+
+    faiss_index = index.index.vector_store.client
+    vectors = faiss_index.index.reconstruct_n(0, faiss_index.ntotal)
+    print(f"Loaded {len(vectors)} vectors of dimension {vectors.shape[1]}.")
+
+    if args.queries:
+        embed_model = index.storage_context.embed_model
+        queries = np.array([embed_model.get_query_embedding(q) for q in args.queries], dtype="float32")
+    else:
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(len(vectors), size=min(args.num_samples, len(vectors)), replace=False)]
+
+    results = evaluate_storage_options(vectors, queries, top_k=args.top_k)
+    baseline = results[0][1]
+    print(f"\n{'dtype':<8} {'dim':>5} {'reduction':<9} {'memory':>10} {'saved':>7} {f'recall@{args.top_k}':>10} {'build':>7}")
+    for (vector_dtype, reduced_dim, reduction), memory, recall, build_time in results:
+        print(f"{vector_dtype:<8} {reduced_dim or vectors.shape[1]:>5} {reduction if reduced_dim else '-':<9} "
+              f"{memory / 1e6:>8.1f}MB {1 - memory / baseline:>7.1%} {recall:>10.3f} {build_time:>6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
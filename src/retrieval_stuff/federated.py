@@ -0,0 +1,143 @@
+from src.retrieval_stuff.retriever import HuggingFaceVectorRetriever, normalize_query
+from src.retrieval_stuff.metrics import metrics
+from llama_index.core.schema import NodeWithScore
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FederatedSearch:
+    """
+    Searches several indexes with one query and merges the results by score.
+
+    Indexes built with the same embedding model share the registry's model instance, so the query is
+    embedded once per model and the embedding is handed to every index using it. The per-index searches
+    then run concurrently. When every source scores its results the same way (cosine similarity,
+    fused or cross-encoder scores) the results are merged by score. Sources with different kinds of
+    score, e.g. hybrid and plain vector sources, or a source whose reranking timed out next to reranked
+    ones, are merged by rank with reciprocal rank fusion instead, as their raw scores are on different scales.
+    """
+    def __init__(self, top_k: int = 10, max_per_source: int | None = None, max_workers: int = 4, rrf_k: int = 60):
+        """
+        Args:
+            top_k: Number of merged results to return.
+            max_per_source: Max results any single source may contribute; defaults to no quota.
+            max_workers: Max number of indexes searched at the same time.
+            rrf_k: Reciprocal rank fusion constant used to merge sources whose scores can't be compared.
+        """
+        self.top_k = top_k
+        self.max_per_source = max_per_source
+        self.rrf_k = rrf_k
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="federated")
+
+
+    def _embed_once(self, retrievers: list[HuggingFaceVectorRetriever], normalized_query: str):
+        """
+        Embed the query once per distinct embedding model and seed each retriever's embedding cache with it.
+        """
+        embeddings = {}
+        for retriever in retrievers:
+            model = retriever.index.storage_context.embed_model
+            if id(model) not in embeddings:
+                embeddings[id(model)] = retriever.embed_query(normalized_query)
+            else:
+                retriever.embedding_cache.put(normalized_query, embeddings[id(model)])
+
+
+    def search(self, retrievers: dict[str, HuggingFaceVectorRetriever], query: str,
+               rerank: bool = False, top_k: int = None, filters: dict[str, str] | None = None) -> list[tuple[str, NodeWithScore]]:
+        """
+        Search every retriever and merge the results.
+
+        Args:
+            retrievers: Source name -> retriever.
+            top_k: Overrides the number of merged results. Above the default top_k, e.g. to page through
+                results, the first top_k results are the same as without it and the rest follow.
+            filters: Applied to every source, see HuggingFaceVectorStoreIndex.get_filter_ids.
+
+        Returns:
+            (source name, node) pairs, best first.
+        """
+        top_k = top_k or self.top_k
+        # Take enough from each source to fill the quota, so a source with weaker matches can still fill in
+        per_source = min(top_k, self.max_per_source or top_k)
+        self._embed_once(list(retrievers.values()), normalize_query(query))
+
+        futures = {
+            name: self._executor.submit(retriever.retrieve_scored, query, rerank=rerank, top_k=per_source, filters=filters)
+            for name, retriever in retrievers.items()
+        }
+        lists, score_kinds = {}, {}
+        for name, future in futures.items():
+            try:
+                lists[name], score_kinds[name] = future.result()
+            except Exception as e:
+                logger.error(f"Error searching {name}: {e}")
+
+        # The first page is merged exactly as a search without top_k would merge it
+        page_size = min(top_k, self.top_k)
+        page_per_source = min(page_size, self.max_per_source or page_size)
+        # A source whose reranking timed out keeps its vector scores, which can't be compared with cross-encoder ones
+        results = self._merge({name: nodes[: page_per_source] for name, nodes in lists.items()},
+                              len(set(score_kinds.values())) <= 1, page_size, page_per_source)
+        if top_k <= page_size:
+            return results
+
+        # Beyond the first page sources list their other candidates in vector order, with their vector scores
+        shown = {(name, node.node.node_id) for name, node in results}
+        rest = {name: [node for node in nodes if (name, node.node.node_id) not in shown] for name, nodes in lists.items()}
+        counts = {}
+        for name, _ in results:
+            counts[name] = counts.get(name, 0) + 1
+        base_kinds = {retrievers[name].score_kind for name in lists}
+        return results + self._merge(rest, len(base_kinds) <= 1, top_k - len(results), per_source, counts)
+
+
+    def _merge(self, lists: dict[str, list[NodeWithScore]], by_score: bool, top_k: int, per_source: int,
+               counts: dict[str, int] | None = None) -> list[tuple[str, NodeWithScore]]:
+        """
+        Merge ranked per-source lists, by score or, for scores that can't be compared, by rank.
+
+        Args:
+            per_source: Max results per source, counting those already in counts.
+        """
+        candidates = [(name, rank, node) for name, nodes in lists.items() for rank, node in enumerate(nodes)]
+        if by_score:
+            candidates.sort(key=lambda candidate: candidate[2].score, reverse=True)
+        else:
+            # Reciprocal rank fusion over the per-source lists; sources tie at equal ranks and keep their order
+            candidates.sort(key=lambda candidate: 1.0 / (self.rrf_k + candidate[1] + 1), reverse=True)
+        results, counts = [], dict(counts or {})
+        for name, _, node in candidates:
+            if len(results) == top_k:
+                break
+            if counts.get(name, 0) >= per_source:
+                continue
+            counts[name] = counts.get(name, 0) + 1
+            results.append((name, node))
+        return results
+
+
+    def retrieve(self, retrievers: dict[str, HuggingFaceVectorRetriever], query: str,
+                 rerank: bool = False, top_k: int = None, filters: dict[str, str] | None = None) -> list[str]:
+        """
+        Same as search, formatted by the sources' retrievers and labelled with the source name.
+        """
+        return self.format(retrievers, self.search(retrievers, query, rerank=rerank, top_k=top_k, filters=filters), query)
+
+
+    def format(self, retrievers: dict[str, HuggingFaceVectorRetriever], results: list[tuple[str, NodeWithScore]], query: str) -> list[str]:
+        """
+        Format (source name, node) pairs returned by search, labelled with the source name.
+        """
+        labels = [f"Source: {name}\n -----------\n " for name, _ in results]
+        builders = [retriever for retriever in retrievers.values() if retriever.response_builder is not None]
+        with metrics.timer("format"):
+            if builders and results:
+                # One budget for the merged results; every source embedded the query with the same model
+                retriever = builders[0]
+                return retriever.response_builder.build(
+                    [node for _, node in results], retriever.embed_query(normalize_query(query)),
+                    retriever.index.storage_context.embed_model, labels=labels)
+            return [label + retrievers[name]._parse_results([node])[0] for label, (name, node) in zip(labels, results)]
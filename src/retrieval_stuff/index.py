@@ -1,8 +1,106 @@
-from llama_index.core import Settings, Document, VectorStoreIndex, load_index_from_storage, StorageContext, ServiceContext
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.vector_stores.faiss import FaissVectorStore
+from llama_index.core import Settings, Document, VectorStoreIndex, load_index_from_storage, StorageContext
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import BaseNode
+from llama_index.core.llms import MockLLM
+from src.retrieval_stuff.embedding import embedding_registry
+from src.retrieval_stuff.vector_store import IdMappedFaissVectorStore, build_faiss_index, index_memory_bytes
+from src.retrieval_stuff.lexical import BM25Index
+from src.retrieval_stuff.cache import LRUCache
+from src.retrieval_stuff.parent_store import ParentStore
+from bisect import bisect_left, bisect_right
 import faiss
+import hashlib
+import json
+import numpy as np
 import os
+from datetime import datetime
+import shutil
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+LEXICAL_INDEX_FILE = "lexical_index.npz"
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+# Older versions are kept around briefly so a server that is still loading one doesn't lose it.
+KEEP_VERSIONS = 3
+# Search filters: Confluence space key, handbook subdirectory (includes nested ones) and title prefix
+FILTER_KEYS = ("space", "subdirectory", "title_prefix")
+
+
+def get_current_version(path: str) -> str | None:
+    """
+    Name of the published version of the index at path, or None for an unversioned index.
+    """
+    try:
+        with open(os.path.join(path, CURRENT_FILE), "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _publish_version(path: str, version: str):
+    # os.replace is atomic, so readers see either the old pointer or the new one, never a partial write.
+    tmp_path = os.path.join(path, f".{CURRENT_FILE}.{uuid.uuid4().hex}")
+    with open(tmp_path, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(path, CURRENT_FILE))
+
+
+def _prune_versions(path: str, keep: int = KEEP_VERSIONS):
+    versions_dir = os.path.join(path, VERSIONS_DIR)
+    current = get_current_version(path)
+    versions = sorted(v for v in os.listdir(versions_dir) if not v.startswith("."))
+    for version in versions[:-keep]:
+        if version != current:
+            shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+
+
+def get_document_id(doc) -> str:
+    """
+    Stable id of the source page/file a document or node was chunked from.
+    """
+    metadata = doc.metadata
+    return metadata.get("doc_id") or metadata.get("file_path") or metadata.get("title") or doc.ref_doc_id or doc.id_
+
+
+def _filter_values(node) -> dict[str, str]:
+    metadata = node.metadata
+    return {
+        "space": (metadata.get("space") or "").casefold(),
+        "subdirectory": (metadata.get("subdirectory") or "").strip("/").casefold(),
+        # Handbook files have no title, their file name is what gets shown instead
+        "title_prefix": (metadata.get("title") or metadata.get("file_name") or "").casefold(),
+    }
+
+
+def _group_chunks(items) -> dict[str, list[str]]:
+    """
+    Texts of documents or nodes grouped by source document, in chunk_index order. Pieces sharing a
+    chunk_index (a chunk the node parser split further) are joined back into one chunk.
+    """
+    groups: dict[str, dict[int, list[str]]] = {}
+    for item in items:
+        chunks = groups.setdefault(get_document_id(item), {})
+        chunks.setdefault(item.metadata.get("chunk_index", 0), []).append(item.text)
+    return {doc_id: [" ".join(chunks[i]) for i in sorted(chunks)] for doc_id, chunks in groups.items()}
+
+
+def _next_content_id(content_id: str, change: list[str]) -> str:
+    """
+    Content id after an in-place change: the same change made to the same content gives the same id
+    in any process, any other change a different one.
+    """
+    return hashlib.sha256(json.dumps([content_id] + change).encode()).hexdigest()[:32]
+
+
+def _lexical_text(node) -> str:
+    return f"{node.metadata.get('title', '')}\n{node.get_content()}"
+
 
 class Index:
     def __init__(self, index_name: str, path: str, chunk_size: int = 5_000):
@@ -19,6 +117,10 @@ class Index:
     def update(self, documents: list[Document]):
         # Update the index with new documents.
         raise NotImplementedError("Subclasses must implement this method")
+
+    def delete(self, doc_ids: list[str]):
+        # Remove documents from the index by their stable id.
+        raise NotImplementedError("Subclasses must implement this method")
     
     def load(self, override: bool = False):
         # Load the index from the database.
@@ -26,9 +128,9 @@ class Index:
             try:
                 self._load_index()
             except Exception as e:
-                print(f"Error loading index {self.index_name}: {e}")
+                logger.error(f"Error loading index {self.index_name}: {e}")
         else:
-            print("Index already loaded. Use override=True to load a new index.")
+            logger.info("Index already loaded. Use override=True to load a new index.")
             return
         
 
@@ -42,27 +144,60 @@ class HuggingFaceVectorStoreIndex(Index):
                  path: str, 
                  chunk_size: int = 5_000,
                  hf_name: str = "avsolatorio/GIST-small-Embedding-v0", 
-                 dimension: int = 384):
+                 dimension: int = 384,
+                 backend: str = "torch",
+                 vector_dtype: str = "float32",
+                 reduced_dim: int | None = None,
+                 reduction: str = "pca",
+                 mmap: bool = False):
+        """
+        Args:
+            vector_dtype: How vectors are stored: "float32", "float16" or "sq8" (8-bit scalar quantized).
+            reduced_dim: Reduce vectors to this many dimensions before storing them.
+            reduction: "pca" or "truncate" (Matryoshka-style), used when reduced_dim is set.
+            mmap: Memory-map the stored vectors when loading instead of reading them into memory.
+
+        Storage options only apply when creating an index; a loaded index takes them from its manifest.
+        """
         
         self.index_name = index_name
         self.path = path
+        self.chunk_size = chunk_size
+        self.hf_name = hf_name
+        self.backend = backend
+        self.dimension = dimension
+        self.vector_dtype = vector_dtype
+        self.reduced_dim = reduced_dim
+        self.reduction = reduction
+        self.mmap = mmap
         self.index = None
+        self.version = None
+        # Bumped on every in-place change so caches keyed on the index can tell it apart from its last store
+        self.revision = 0
+        # Identifies the content across processes, for caches that outlive one: the stored version it was
+        # loaded from, chained with every in-place change since. The revision restarts at 0 in every process.
+        self.content_id = None
+        self._lexical_index = None
+        self._parent_store = None
+        self._load_path = None
+        self._doc_vector_ids = None
+        self._node_vector_ids = None
+        self._metadata_index = None
+        self._filter_cache = LRUCache(256)
         self._setup_storage_context(hf_name, dimension, chunk_size)
 
 
 
 
     def _setup_storage_context(self, hf_name: str, dimension: int, chunk_size: int):
-        embed_model = HuggingFaceEmbedding(model_name=hf_name)
-        
-        # Set LlamaIndex settings
-        Settings.embed_model = embed_model
-        Settings.llm = None
-        Settings.chunk_size = chunk_size
+        # Models are shared across indexes through the registry rather than the global Settings
+        embed_model = embedding_registry.acquire(hf_name, self.backend)
+        # Setting None makes LlamaIndex print a notice to stdout, which would corrupt the stdio transport
+        Settings.llm = MockLLM()
         
         # Create storage context
-        faiss_index = faiss.IndexFlatL2(dimension)
-        vector_store = FaissVectorStore(faiss_index=faiss_index)
+        faiss_index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+        vector_store = IdMappedFaissVectorStore(faiss_index=faiss_index)
         self.storage_context = StorageContext.from_defaults(vector_store=vector_store)
         self.storage_context.llm = None
         self.storage_context.embed_model = embed_model
@@ -77,26 +212,62 @@ class HuggingFaceVectorStoreIndex(Index):
         if not os.path.exists(self.path):
             os.makedirs(self.path)
 
-        print(f"Creating index {self.index_name}...")
+        logger.info(f"Creating index {self.index_name}...")
         index = VectorStoreIndex.from_documents(
             documents, 
             storage_context=self.storage_context,
-            embed_model=self.storage_context.embed_model
+            embed_model=self.storage_context.embed_model,
+            transformations=[SentenceSplitter(chunk_size=self.chunk_size)]
         )
-        print(f"Index {self.index_name} created.")
+        if self.vector_dtype != "float32" or self.reduced_dim:
+            # Compressed indexes need training, so build at full precision first then re-encode.
+            vector_store = index.vector_store
+            full_size = index_memory_bytes(vector_store.client)
+            vector_store.reencode(build_faiss_index(self.dimension, self.vector_dtype, self.reduced_dim, self.reduction))
+            logger.info(f"Re-encoded vectors as {self.vector_dtype}, dim {self.reduced_dim or self.dimension}: "
+                  f"{full_size / 1e6:.1f}MB -> {index_memory_bytes(vector_store.client) / 1e6:.1f}MB")
         self.index = index
+        self._lexical_index = None
+        self._parent_store = ParentStore()
+        for doc_id, chunks in _group_chunks(documents).items():
+            self._parent_store.add(doc_id, chunks)
+        self._doc_vector_ids = None
+        self._node_vector_ids = None
+        self._metadata_index = None
+        self._filter_cache.clear()
+        # Not stored yet, so no other process can have the same content
+        self.content_id = uuid.uuid4().hex
+        self.get_lexical_index()
+        logger.info(f"Index {self.index_name} created.")
     
     
     def store(self):
         """
-        Store the index in the database.
+        Store the index in the database as a new version and publish it.
+
+        The index is written to a staging directory under `versions/`, renamed into place once complete,
+        and only then made current by atomically swapping the CURRENT pointer. A crashed or in-progress
+        build never leaves a half-written index where a reader can find it.
         """
-        print(f"Storing index {self.index_name}...")
+        logger.info(f"Storing index {self.index_name}...")
         if self.index is not None:
-            if not os.path.exists(self.path):
-                os.makedirs(self.path)
-            self.index.storage_context.persist(persist_dir=self.path)
-            print(f"Index {self.index_name} stored.")
+            # Sortable by creation time, unique across concurrent builds
+            version = datetime.now().strftime("%Y%m%d-%H%M%S-%f") + f"-{uuid.uuid4().hex[:6]}"
+            versions_dir = os.path.join(self.path, VERSIONS_DIR)
+            os.makedirs(versions_dir, exist_ok=True)
+
+            staging_path = os.path.join(versions_dir, f".staging-{version}")
+            self.index.storage_context.persist(persist_dir=staging_path)
+            self.get_lexical_index().save(os.path.join(staging_path, LEXICAL_INDEX_FILE))
+            self.get_parent_store().save(staging_path)
+            self._write_manifest(staging_path)
+            os.rename(staging_path, os.path.join(versions_dir, version))
+
+            _publish_version(self.path, version)
+            self.version = version
+            self.content_id = version
+            _prune_versions(self.path)
+            logger.info(f"Index {self.index_name} stored as version {version}.")
         else:
             raise ValueError("Index is not created yet. Please load the index first.")
 
@@ -104,24 +275,297 @@ class HuggingFaceVectorStoreIndex(Index):
     
     def update(self, documents: list[Document]):
         """
-        Update the index with new documents.
+        Update the index with new or changed documents.
         """
-        if self.index is not None:
-            self.index.update(documents)
-        else:
+        self.upsert(documents)
+
+
+
+    def upsert(self, documents: list[Document]):
+        """
+        Insert documents, replacing every chunk already stored under the same stable document id.
+
+        Only the given documents are embedded; the rest of the index is left untouched, so a handful
+        of changed pages can be patched into a live index without a rebuild.
+        """
+        if self.index is None:
             raise ValueError("Index is not created yet. Please load the index first.")
 
+        doc_ids = {get_document_id(doc) for doc in documents}
+        self.delete(list(doc_ids))
+
+        nodes = SentenceSplitter(chunk_size=self.chunk_size).get_nodes_from_documents(documents)
+        first_id = self.index.vector_store.next_id
+        self.index.insert_nodes(nodes)
+
+        # Only look at the ids allocated by this insert, not the whole index
+        doc_vector_ids = self._get_doc_vector_ids()
+        lexical_index = self.get_lexical_index()
+        nodes_dict = self.index.index_struct.nodes_dict
+        new_nodes = {node.node_id: node for node in nodes}
+        for vector_id in map(str, range(first_id, self.index.vector_store.next_id)):
+            node_id = nodes_dict.get(vector_id)
+            if node_id in new_nodes:
+                doc_vector_ids.setdefault(get_document_id(new_nodes[node_id]), []).append(vector_id)
+                lexical_index.add(int(vector_id), _lexical_text(new_nodes[node_id]))
+                if self._node_vector_ids is not None:
+                    self._node_vector_ids[node_id] = vector_id
+        parent_store = self.get_parent_store()
+        for doc_id, chunks in _group_chunks(documents).items():
+            parent_store.add(doc_id, chunks)
+        self.content_id = _next_content_id(self.content_id, ["upsert"] + sorted(f"{get_document_id(doc)}:{doc.hash}" for doc in documents))
+        self.revision += 1
+        logger.info(f"Upserted {len(doc_ids)} documents ({len(nodes)} nodes) into index {self.index_name}.")
+
+
+
+    def delete(self, doc_ids: list[str]):
+        """
+        Remove every chunk of the given documents from the index.
+
+        Vectors are tombstoned in the vector store and compacted away in the background,
+        nodes are dropped from the index struct and docstore straight away. The vectors go first,
+        so a concurrent search never gets back a vector whose node is already gone.
+        """
+        if self.index is None:
+            raise ValueError("Index is not created yet. Please load the index first.")
+
+        doc_vector_ids = self._get_doc_vector_ids()
+        vector_ids = []
+        for doc_id in doc_ids:
+            vector_ids.extend(doc_vector_ids.pop(doc_id, []))
+        if not vector_ids:
+            return
+
+        self.index.vector_store.delete_ids(vector_ids)
+        self.get_lexical_index().remove([int(vector_id) for vector_id in vector_ids])
+        self.get_parent_store().remove(doc_ids)
+
+        nodes_dict = self.index.index_struct.nodes_dict
+        for vector_id in vector_ids:
+            node_id = nodes_dict.pop(vector_id, None)
+            if node_id is not None:
+                self.index.docstore.delete_document(node_id, raise_error=False)
+                if self._node_vector_ids is not None:
+                    self._node_vector_ids.pop(node_id, None)
+        self.index.storage_context.index_store.add_index_struct(self.index.index_struct)
+        self.content_id = _next_content_id(self.content_id, ["delete"] + sorted(doc_ids))
+        self.revision += 1
+
+
+
+    def get_lexical_index(self) -> BM25Index:
+        """
+        BM25 index over the same ids as the vector store. Indexes stored without one get it built on first use.
+        """
+        if self._lexical_index is None:
+            logger.info(f"Building lexical index for {self.index_name}...")
+            lexical_index = BM25Index()
+            for vector_id, node_id in self.index.index_struct.nodes_dict.items():
+                node = self.index.docstore.get_node(node_id, raise_error=False)
+                if node is not None:
+                    lexical_index.add(int(vector_id), _lexical_text(node))
+            lexical_index.compact()
+            self._lexical_index = lexical_index
+        return self._lexical_index
+
+
+
+    def get_parent_store(self) -> ParentStore:
+        """
+        Full text of the source documents, chunk by chunk. Opened from disk on first use;
+        indexes stored without one get it rebuilt from their nodes.
+        """
+        if self._parent_store is None:
+            if self._load_path and ParentStore.exists(self._load_path):
+                self._parent_store = ParentStore.load(self._load_path)
+            else:
+                logger.info(f"Building parent store for {self.index_name}...")
+                parent_store = ParentStore()
+                docstore = self.index.docstore
+                nodes = [docstore.get_node(node_id, raise_error=False) for node_id in self.index.index_struct.nodes_dict.values()]
+                for doc_id, chunks in _group_chunks(node for node in nodes if node is not None).items():
+                    parent_store.add(doc_id, chunks)
+                self._parent_store = parent_store
+        return self._parent_store
+
+
+
+    def get_nodes(self, vector_ids: list[int | str]) -> list[BaseNode | None]:
+        """
+        Nodes stored under the given vector ids, None for ids that are no longer in the index.
+        """
+        nodes_dict = self.index.index_struct.nodes_dict
+        docstore = self.index.docstore
+        return [
+            docstore.get_node(nodes_dict[str(vector_id)], raise_error=False) if str(vector_id) in nodes_dict else None
+            for vector_id in vector_ids
+        ]
+
+
+
+    def get_filter_ids(self, filters: dict[str, str | None]) -> np.ndarray:
+        """
+        Sorted vector ids of the chunks matching every given filter.
+
+        Args:
+            filters: Any of FILTER_KEYS. "space" matches exactly, "subdirectory" matches the directory and
+                everything below it, "title_prefix" matches the start of the title. Case-insensitive;
+                None values are ignored.
+        """
+        filters = {key: value for key, value in filters.items() if value}
+        unknown = set(filters) - set(FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown filters {sorted(unknown)}, expected any of {list(FILTER_KEYS)}.")
+
+        cache_key = (self.version, self.revision, tuple(sorted(filters.items())))
+        ids = self._filter_cache.get(cache_key)
+        if ids is not None:
+            return ids
+
+        metadata_index = self._get_metadata_index()
+        for key, value in filters.items():
+            values, key_ids = metadata_index[key]
+            value = value.strip("/").casefold() if key == "subdirectory" else value.casefold()
+            if key == "space":
+                matched = key_ids[bisect_left(values, value): bisect_right(values, value)]
+            elif key == "subdirectory":
+                nested = value + "/"
+                matched = np.concatenate([
+                    key_ids[bisect_left(values, value): bisect_right(values, value)],
+                    key_ids[bisect_left(values, nested): bisect_left(values, nested + "\U0010ffff")],
+                ])
+            else:
+                matched = key_ids[bisect_left(values, value): bisect_left(values, value + "\U0010ffff")]
+            matched = np.sort(matched)
+            ids = matched if ids is None else np.intersect1d(ids, matched, assume_unique=True)
+        if ids is None:
+            ids = np.array(sorted(int(vector_id) for vector_id in self.index.index_struct.nodes_dict), dtype=np.int64)
+
+        self._filter_cache.put(cache_key, ids)
+        return ids
+
+
+
+    def get_vectors(self, node_ids: list[str]) -> np.ndarray | None:
+        """
+        Stored vectors of the given nodes, one row per node. None if any of them is no longer in the index.
+        """
+        # node id -> vector id, built on first use and kept up to date by upsert and delete
+        if self._node_vector_ids is None:
+            nodes_dict = self.index.index_struct.nodes_dict
+            self._node_vector_ids = {node_id: vector_id for vector_id, node_id in nodes_dict.items()}
+        node_vector_ids = self._node_vector_ids
+        if any(node_id not in node_vector_ids for node_id in node_ids):
+            return None
+        try:
+            return self.index.vector_store.reconstruct([node_vector_ids[node_id] for node_id in node_ids])
+        except RuntimeError:
+            # Removed by a concurrent delete/compaction
+            return None
+
+
+
+    def close(self):
+        """
+        Release this index's reference to its embedding model.
+        """
+        embedding_registry.release(self.hf_name, self.backend)
+
+
+
+    def _write_manifest(self, path: str):
+        manifest = {
+            "index_name": self.index_name,
+            "hf_name": self.hf_name,
+            "backend": self.backend,
+            "dimension": self.dimension,
+            "chunk_size": self.chunk_size,
+            "vector_dtype": self.vector_dtype,
+            "reduced_dim": self.reduced_dim,
+            "reduction": self.reduction,
+            "num_vectors": self.index.vector_store.client.ntotal,
+        }
+        with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+
+
+    def _read_manifest(self, path: str):
+        # Indexes built before the manifest existed used the defaults.
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+
+        if (manifest["hf_name"], manifest["backend"]) != (self.hf_name, self.backend):
+            # Queries must be embedded with the model the index was built with.
+            embedding_registry.release(self.hf_name, self.backend)
+            self.storage_context.embed_model = embedding_registry.acquire(manifest["hf_name"], manifest["backend"])
+        for key in ("hf_name", "backend", "dimension", "chunk_size", "vector_dtype", "reduced_dim", "reduction"):
+            setattr(self, key, manifest[key])
+
+
+
+    def _get_metadata_index(self) -> dict[str, tuple[list[str], np.ndarray]]:
+        # Filter key -> (sorted values, vector ids aligned with them), rebuilt whenever the index changes.
+        # Sorted values turn exact and prefix matches into a pair of binary searches.
+        if self._metadata_index is None or self._metadata_index[0] != self.revision:
+            entries = {key: [] for key in FILTER_KEYS}
+            for vector_id, node_id in self.index.index_struct.nodes_dict.items():
+                node = self.index.docstore.get_node(node_id, raise_error=False)
+                if node is None:
+                    continue
+                for key, value in _filter_values(node).items():
+                    entries[key].append((value, int(vector_id)))
+            metadata_index = {}
+            for key, pairs in entries.items():
+                pairs.sort()
+                metadata_index[key] = ([value for value, _ in pairs], np.array([i for _, i in pairs], dtype=np.int64))
+            self._metadata_index = (self.revision, metadata_index)
+        return self._metadata_index[1]
+
+
+
+    def _get_doc_vector_ids(self) -> dict[str, list[str]]:
+        # Stable document id -> vector ids of its chunks, built lazily from the docstore.
+        if self._doc_vector_ids is None:
+            self._doc_vector_ids = {}
+            for vector_id, node_id in self.index.index_struct.nodes_dict.items():
+                node = self.index.docstore.get_node(node_id, raise_error=False)
+                if node is not None:
+                    self._doc_vector_ids.setdefault(get_document_id(node), []).append(vector_id)
+        return self._doc_vector_ids
+
     
     
     def _load_index(self):
-        print(f"Loading index {self.index_name}...")
-        vector_store = FaissVectorStore.from_persist_dir(self.path)
+        logger.info(f"Loading index {self.index_name}...")
+        # Indexes stored before versioning live directly in self.path
+        version = get_current_version(self.path)
+        load_path = os.path.join(self.path, VERSIONS_DIR, version) if version else self.path
+
+        self._read_manifest(load_path)
+        embed_model = self.storage_context.embed_model
+        vector_store = IdMappedFaissVectorStore.from_persist_dir(load_path, mmap=self.mmap)
         storage_context = StorageContext.from_defaults(
-            vector_store=vector_store, persist_dir=self.path
+            vector_store=vector_store, persist_dir=load_path
         )
+        storage_context.embed_model = embed_model
+        storage_context.chunk_size = self.chunk_size
         self.storage_context = storage_context
-        self.index = load_index_from_storage(storage_context=storage_context)
-        print(f"Index {self.index_name} loaded.")
+        self.index = load_index_from_storage(storage_context=storage_context, embed_model=embed_model)
+        lexical_path = os.path.join(load_path, LEXICAL_INDEX_FILE)
+        self._lexical_index = BM25Index.load(lexical_path) if os.path.exists(lexical_path) else None
+        self._parent_store = None
+        self._load_path = load_path
+        self.version = version
+        self.content_id = version or f"unversioned:{load_path}"
+        self._doc_vector_ids = None
+        self._node_vector_ids = None
+        self._metadata_index = None
+        logger.info(f"Index {self.index_name} loaded (version {version or 'unversioned'}).")
 
 
 
@@ -0,0 +1,189 @@
+import numpy as np
+import re
+import threading
+
+# Keeps identifiers like service names, flag names and error codes (kvyo-deploy, ERR_502, v2.1) whole.
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+(?:[-.:/][a-z0-9_]+)*")
+MAX_TOKEN_LENGTH = 64
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lowercase word tokens. Compound identifiers are indexed whole and as their parts,
+    so "kvyo-deploy" matches queries for "kvyo-deploy", "kvyo" and "deploy".
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if len(token) > MAX_TOKEN_LENGTH:
+            continue
+        tokens.append(token)
+        parts = re.split(r"[-.:/]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over the same int64 ids as the vector store.
+
+    Postings live in one compact CSR segment (term -> doc ids and term frequencies as flat numpy arrays)
+    plus a small in-memory delta for documents added since the last `compact()`. Removed documents
+    are masked out at query time until the next compaction drops their postings.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._terms: dict[str, int] = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._doc_ids = np.zeros(0, dtype=np.int64)
+        self._tfs = np.zeros(0, dtype=np.uint16)
+        self._delta: dict[str, dict[int, int]] = {}
+        self._doc_lens = np.zeros(0, dtype=np.int32)
+        self._live = np.zeros(0, dtype=bool)
+        self._total_len = 0
+        self._num_docs = 0
+        self._lock = threading.RLock()
+
+
+    def __len__(self) -> int:
+        return self._num_docs
+
+
+    def _grow(self, max_id: int):
+        if max_id < len(self._doc_lens):
+            return
+        size = max(max_id + 1, 2 * len(self._doc_lens))
+        self._doc_lens = np.concatenate([self._doc_lens, np.zeros(size - len(self._doc_lens), dtype=np.int32)])
+        self._live = np.concatenate([self._live, np.zeros(size - len(self._live), dtype=bool)])
+
+
+    def add(self, doc_id: int, text: str):
+        """
+        Index a document. Ids are never reused, like the vector store ids they mirror.
+        """
+        tokens = tokenize(text)
+        with self._lock:
+            self._grow(doc_id)
+            counts: dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                self._delta.setdefault(token, {})[doc_id] = min(count, np.iinfo(np.uint16).max)
+            self._doc_lens[doc_id] = len(tokens)
+            self._live[doc_id] = True
+            self._total_len += len(tokens)
+            self._num_docs += 1
+
+
+    def remove(self, doc_ids: list[int]):
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id < len(self._live) and self._live[doc_id]:
+                    self._live[doc_id] = False
+                    self._total_len -= int(self._doc_lens[doc_id])
+                    self._num_docs -= 1
+
+
+    def _postings(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        row = self._terms.get(term)
+        if row is None:
+            doc_ids, tfs = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint16)
+        else:
+            start, end = self._offsets[row], self._offsets[row + 1]
+            doc_ids, tfs = self._doc_ids[start:end], self._tfs[start:end]
+        delta = self._delta.get(term)
+        if delta:
+            doc_ids = np.concatenate([doc_ids, np.fromiter(delta.keys(), dtype=np.int64, count=len(delta))])
+            tfs = np.concatenate([tfs, np.fromiter(delta.values(), dtype=np.uint16, count=len(delta))])
+        return doc_ids, tfs
+
+
+    def search(self, query: str, top_k: int = 10, allowed_ids: np.ndarray | None = None) -> list[tuple[int, float]]:
+        """
+        Top documents for a query as (id, score) pairs, best first.
+
+        Args:
+            allowed_ids: If given, only these ids can be returned.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or self._num_docs == 0:
+                return []
+            live = self._live
+            if allowed_ids is not None:
+                live = np.zeros_like(self._live)
+                allowed_ids = allowed_ids[allowed_ids < len(live)]
+                live[allowed_ids] = self._live[allowed_ids]
+
+            avg_len = self._total_len / self._num_docs
+            scores = np.zeros(len(self._doc_lens), dtype=np.float32)
+            for term in terms:
+                doc_ids, tfs = self._postings(term)
+                mask = live[doc_ids]
+                doc_ids, tfs = doc_ids[mask], tfs[mask].astype(np.float32)
+                if len(doc_ids) == 0:
+                    continue
+                idf = np.log(1 + (self._num_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * self._doc_lens[doc_ids] / avg_len)
+                np.add.at(scores, doc_ids, idf * tfs * (self.k1 + 1) / (tfs + norm))
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in candidates]
+
+
+    def compact(self):
+        """
+        Merge the delta into the CSR segment and drop postings of removed documents.
+        """
+        with self._lock:
+            terms, all_ids, all_tfs = [], [], []
+            for term in sorted(set(self._terms) | set(self._delta)):
+                doc_ids, tfs = self._postings(term)
+                mask = self._live[doc_ids]
+                if mask.any():
+                    terms.append(term)
+                    all_ids.append(doc_ids[mask])
+                    all_tfs.append(tfs[mask])
+
+            self._terms = {term: row for row, term in enumerate(terms)}
+            self._offsets = np.concatenate([[0], np.cumsum([len(ids) for ids in all_ids], dtype=np.int64)]).astype(np.int64)
+            self._doc_ids = np.concatenate(all_ids) if all_ids else np.zeros(0, dtype=np.int64)
+            self._tfs = np.concatenate(all_tfs) if all_tfs else np.zeros(0, dtype=np.uint16)
+            self._delta = {}
+
+
+    def save(self, path: str):
+        self.compact()
+        with self._lock:
+            vocabulary = np.frombuffer("\n".join(self._terms).encode("utf-8"), dtype=np.uint8)
+            np.savez_compressed(
+                path,
+                vocabulary=vocabulary,
+                offsets=self._offsets,
+                doc_ids=self._doc_ids,
+                tfs=self._tfs,
+                doc_lens=self._doc_lens,
+                live=self._live,
+                params=np.array([self.k1, self.b]),
+            )
+
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with np.load(path) as data:
+            k1, b = data["params"]
+            index = cls(k1=float(k1), b=float(b))
+            vocabulary = data["vocabulary"].tobytes().decode("utf-8")
+            index._terms = {term: row for row, term in enumerate(vocabulary.split("\n"))} if vocabulary else {}
+            index._offsets = data["offsets"]
+            index._doc_ids = data["doc_ids"]
+            index._tfs = data["tfs"]
+            index._doc_lens = data["doc_lens"]
+            index._live = data["live"]
+        index._total_len = int(index._doc_lens[index._live].sum())
+        index._num_docs = int(index._live.sum())
+        return index
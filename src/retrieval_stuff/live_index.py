@@ -0,0 +1,127 @@
+from src.retrieval_stuff.index import HuggingFaceVectorStoreIndex, get_current_version
+from src.retrieval_stuff.retriever import HuggingFaceVectorRetriever
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LiveRetriever:
+    """
+    Serves queries from the published version of an index and hot swaps to newer versions.
+
+    A watcher thread polls the index's CURRENT pointer. When it moves, the new version is loaded in the
+    background and swapped in with a single reference assignment: queries already running keep the
+    retriever they started with, new queries get the new one, and nothing is dropped in between.
+    """
+    def __init__(self, index_name: str, path: str, top_k: int = 10,
+                 retriever_cls: type[HuggingFaceVectorRetriever] = HuggingFaceVectorRetriever, mmap: bool = False,
+                 warmup_queries: list[str] | None = None, hf_name: str | None = None, **retriever_kwargs):
+        """
+        Args:
+            retriever_cls: Retriever to build over each loaded version, e.g. HybridRetriever.
+            mmap: Memory-map the vectors of each loaded version rather than reading them into memory.
+            warmup_queries: Queries run through each loaded version before it starts serving, so real
+                queries don't pay for the model's first-call setup.
+            hf_name: Embedding model the index was built with, so it's loaded straight away instead of the
+                default model being loaded first and swapped once the manifest is read.
+            retriever_kwargs: Extra arguments for retriever_cls.
+        """
+        self.index_name = index_name
+        self.path = path
+        self.top_k = top_k
+        self.retriever_cls = retriever_cls
+        self.mmap = mmap
+        self.warmup_queries = warmup_queries or []
+        self.hf_name = hf_name
+        self.retriever_kwargs = retriever_kwargs
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self._retriever = self._load()
+        if self._retriever is None:
+            raise ValueError(f"Could not load index {index_name} from {path}.")
+
+
+    @property
+    def retriever(self) -> HuggingFaceVectorRetriever:
+        return self._retriever
+
+
+    @property
+    def warmup_stats(self) -> dict[str, float] | None:
+        return self._retriever.warmup_stats
+
+
+    @property
+    def version(self) -> str | None:
+        return self._retriever.index.version
+
+
+    def retrieve(self, query: str, rerank: bool = False, top_k: int = None, filters: dict[str, str] | None = None) -> list[str]:
+        return self._retriever.retrieve(query, rerank=rerank, top_k=top_k, filters=filters)
+
+
+    def retrieve_many(self, queries: list[str], rerank: bool = False, top_k: int = None,
+                      filters: dict[str, str] | None = None) -> list[list[str]]:
+        return self._retriever.retrieve_many(queries, rerank=rerank, top_k=top_k, filters=filters)
+
+
+    def _load(self) -> HuggingFaceVectorRetriever | None:
+        model_kwargs = {"hf_name": self.hf_name} if self.hf_name else {}
+        index = HuggingFaceVectorStoreIndex(index_name=self.index_name, path=self.path, mmap=self.mmap, **model_kwargs)
+        index.load()
+        if index.index is None:
+            index.close()
+            return None
+        retriever = self.retriever_cls(index, top_k=self.top_k, **self.retriever_kwargs)
+        if self.warmup_queries:
+            stats = retriever.warm_up(self.warmup_queries, rerank=retriever.reranker is not None)
+            warm = f", then {stats['warm_ms']:.0f}ms" if stats["warm_ms"] is not None else ""
+            logger.info(f"Warmed up index {self.index_name}: first query {stats['cold_ms']:.0f}ms{warm}.")
+        return retriever
+
+
+    def reload(self) -> bool:
+        """
+        Load the currently published version and swap it in if it is newer than the one being served.
+
+        Returns whether a new version was swapped in.
+        """
+        with self._reload_lock:
+            if get_current_version(self.path) == self.version:
+                return False
+
+            retriever = self._load()
+            if retriever is None:
+                logger.error(f"Failed to reload index {self.index_name}, still serving version {self.version}.")
+                return False
+
+            old_retriever, self._retriever = self._retriever, retriever
+            # Drops the embedding model reference, which the new index already holds, and stops the old
+            # retriever's worker threads once their work is done, so in-flight queries are unaffected.
+            old_retriever.close()
+            logger.info(f"Index {self.index_name} reloaded: version {old_retriever.index.version} -> {self.version}.")
+            return True
+
+
+    def watch(self, interval: float = 30.0):
+        """
+        Start polling for newly published versions every interval seconds.
+        """
+        if self._watcher is not None:
+            return
+
+        def poll():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.error(f"Error reloading index {self.index_name}: {e}")
+
+        self._watcher = threading.Thread(target=poll, name=f"{self.index_name}-watcher", daemon=True)
+        self._watcher.start()
+
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,98 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+from typing import Any, Callable
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundLoader:
+    """
+    Loads slow components (indexes, models) on worker threads, in parallel, and keeps track of their progress.
+
+    Lets a server start answering straight away: callers check or wait on a component by name instead
+    of everything being loaded before the server starts. A component that failed to load is loaded
+    again the next time it is started, so a transient error doesn't leave it failed until a restart.
+    """
+    def __init__(self, max_workers: int = 4):
+        """
+        Args:
+            max_workers: Max number of components loading at the same time.
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="loader")
+        self._futures: dict[str, Future] = {}
+        self._started: dict[str, float] = {}
+        self._finished: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+
+    def start(self, name: str, load: Callable[[], Any]) -> Future:
+        """
+        Start loading a component. The future resolves to whatever load returns.
+
+        Returns the existing future if the component is loading or loaded, starts over if it failed.
+        """
+        def run():
+            logger.info(f"Loading {name}...")
+            try:
+                result = load()
+                logger.info(f"Loaded {name} in {time.time() - self._started[name]:.1f}s.")
+                return result
+            except Exception as e:
+                logger.error(f"Failed to load {name}: {e}")
+                raise
+            finally:
+                with self._lock:
+                    self._finished[name] = time.time()
+
+        with self._lock:
+            future = self._futures.get(name)
+            if future is not None and not (future.done() and future.exception() is not None):
+                return future
+            self._started[name] = time.time()
+            self._finished.pop(name, None)
+            self._futures[name] = self._executor.submit(run)
+            return self._futures[name]
+
+
+    def future(self, name: str) -> Future | None:
+        with self._lock:
+            return self._futures.get(name)
+
+
+    def get(self, name: str) -> Any:
+        """
+        The loaded component, None if it isn't loaded (yet) or failed to load.
+        """
+        future = self.future(name)
+        if future is None or not future.done() or future.exception() is not None:
+            return None
+        return future.result()
+
+
+    def status(self) -> dict[str, dict]:
+        """
+        Per component: state ("loading", "ready" or "failed"), seconds spent loading and the error if it failed.
+        """
+        now = time.time()
+        with self._lock:
+            items = [(name, future, self._started[name], self._finished.get(name)) for name, future in self._futures.items()]
+
+        status = {}
+        for name, future, started, finished in items:
+            if not future.done() or finished is None:
+                status[name] = {"state": "loading", "seconds": now - started}
+            elif future.exception() is not None:
+                status[name] = {"state": "failed", "seconds": finished - started, "error": str(future.exception())}
+            else:
+                status[name] = {"state": "ready", "seconds": finished - started}
+        return status
+
+
+    def ready(self) -> bool:
+        """
+        Whether every component has finished loading, successfully or not.
+        """
+        with self._lock:
+            return all(future.done() for future in self._futures.values())
@@ -0,0 +1,211 @@
+from collections import deque
+from contextlib import contextmanager
+import bisect
+import logging
+import numpy as np
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the Prometheus histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    """
+    Latencies of one stage: bucket counts over the whole run, for Prometheus, and a window of the most
+    recent samples, for percentiles that reflect the current load.
+    """
+    def __init__(self, window: int = 4096):
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+
+    def observe(self, seconds: float):
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+
+    def percentiles(self) -> dict[int, float]:
+        if not self.recent:
+            return {}
+        values = np.percentile(np.fromiter(self.recent, dtype=np.float64, count=len(self.recent)), PERCENTILES)
+        return dict(zip(PERCENTILES, values.tolist()))
+
+
+class Metrics:
+    """
+    Process-wide latency histograms per search stage, counters, and cache hit rates derived from them.
+
+    Stages are timed with `timer`. A `trace` around a whole request also collects the stages it went
+    through on the current thread and logs them as one line when the request ends. Counters named
+    `<cache>_hits` and `<cache>_misses` are reported as that cache's hit rate.
+    """
+    def __init__(self, window: int = 4096):
+        """
+        Args:
+            window: Number of recent samples per stage the percentiles are computed over.
+        """
+        self.window = window
+        self._histograms: dict[str, LatencyHistogram] = {}
+        self._counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started = time.time()
+
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = LatencyHistogram(self.window)
+            histogram.observe(seconds)
+        totals = self._thread_totals()
+        totals[stage] = totals.get(stage, 0.0) + seconds
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            trace[stage] = trace.get(stage, 0.0) + seconds
+
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+
+    def thread_total(self, stage: str) -> float:
+        """
+        Seconds the current thread has spent in a stage so far, for timing a stage that contains it.
+        """
+        return self._thread_totals().get(stage, 0.0)
+
+
+    def _thread_totals(self) -> dict[str, float]:
+        totals = getattr(self._local, "totals", None)
+        if totals is None:
+            totals = self._local.totals = {}
+        return totals
+
+
+    @contextmanager
+    def trace(self, name: str):
+        """
+        Time a whole request as stage `name` and log the time it spent in each stage.
+
+        Traces started inside another trace on the same thread are part of the outer one.
+        """
+        if getattr(self._local, "trace", None) is not None:
+            yield
+            return
+        trace = self._local.trace = {}
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.trace = None
+            total = time.perf_counter() - start
+            self.observe(name, total)
+            stages = " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in trace.items())
+            logger.info("%s took %.1fms: %s", name, total * 1000, stages or "no stages")
+
+
+    def increment(self, counter: str, amount: int = 1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": histogram.count,
+                    "mean_ms": histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+                    **{f"p{p}_ms": value * 1000 for p, value in histogram.percentiles().items()}
+                }
+                for stage, histogram in self._histograms.items()
+            }
+            counters = dict(self._counters)
+
+        hit_rates = {}
+        for counter, hits in counters.items():
+            if counter.endswith("_hits"):
+                cache = counter[: -len("_hits")]
+                total = hits + counters.get(f"{cache}_misses", 0)
+                hit_rates[cache] = hits / total if total else 0.0
+        return {"uptime_seconds": time.time() - self.started, "stages": stages, "counters": counters, "hit_rates": hit_rates}
+
+
+    def format_summary(self) -> str:
+        snapshot = self.snapshot()
+        lines = [f"Uptime: {snapshot['uptime_seconds']:.0f}s", "", f"{'stage':<32} {'count':>8} {'p50':>9} {'p95':>9} {'p99':>9}"]
+        for stage, stats in sorted(snapshot["stages"].items()):
+            percentiles = " ".join(f"{stats.get(f'p{p}_ms', 0.0):>7.1f}ms" for p in PERCENTILES)
+            lines.append(f"{stage:<32} {stats['count']:>8} {percentiles}")
+        if snapshot["hit_rates"]:
+            lines += ["", "Cache hit rates:"]
+            lines += [f"  {cache}: {rate:.1%}" for cache, rate in sorted(snapshot["hit_rates"].items())]
+        if snapshot["counters"]:
+            lines += ["", "Counters:"]
+            lines += [f"  {counter}: {value}" for counter, value in sorted(snapshot["counters"].items())]
+        return "\n".join(lines)
+
+
+    def to_prometheus(self, prefix: str = "kvyo_mcp") -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            histograms = {
+                stage: (list(histogram.bucket_counts), histogram.sum, histogram.count, histogram.percentiles())
+                for stage, histogram in self._histograms.items()
+            }
+        snapshot = self.snapshot()
+
+        lines = [f"# HELP {prefix}_stage_seconds Time spent in each search stage.", f"# TYPE {prefix}_stage_seconds histogram"]
+        for stage, (bucket_counts, total, count, _) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {count}')
+
+        lines += [f"# HELP {prefix}_stage_recent_seconds Percentiles of each stage over its {self.window} most recent samples.",
+                  f"# TYPE {prefix}_stage_recent_seconds gauge"]
+        for stage, (_, _, _, percentiles) in sorted(histograms.items()):
+            for p, value in percentiles.items():
+                lines.append(f'{prefix}_stage_recent_seconds{{stage="{stage}",quantile="{p / 100:g}"}} {value}')
+
+        for counter, value in sorted(snapshot["counters"].items()):
+            lines += [f"# TYPE {prefix}_{counter}_total counter", f"{prefix}_{counter}_total {value}"]
+
+        lines += [f"# HELP {prefix}_cache_hit_ratio Share of lookups answered by each cache.", f"# TYPE {prefix}_cache_hit_ratio gauge"]
+        for cache, rate in sorted(snapshot["hit_rates"].items()):
+            lines.append(f'{prefix}_cache_hit_ratio{{cache="{cache}"}} {rate}')
+        lines += [f"# TYPE {prefix}_uptime_seconds gauge", f"{prefix}_uptime_seconds {snapshot['uptime_seconds']}"]
+        return "\n".join(lines) + "\n"
+
+
+    def write_prometheus(self, path: str, prefix: str = "kvyo_mcp"):
+        """
+        Write the metrics to a file for the node exporter's textfile collector, replacing it atomically.
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.to_prometheus(prefix))
+        os.replace(temp_path, path)
+
+
+
+metrics = Metrics()
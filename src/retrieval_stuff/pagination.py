@@ -0,0 +1,105 @@
+from src.retrieval_stuff.cache import LRUCache
+from src.retrieval_stuff.metrics import metrics
+from typing import Callable
+import secrets
+import threading
+import time
+
+
+class ResultPager:
+    """
+    Serves the results of a search one page at a time.
+
+    The first page is the search's regular result, so it can come straight from the result caches;
+    the response carries a cursor (a random token and the offset of the next page). A page cut short
+    by the response budget shows fewer results than page_size, so the next page starts right after
+    the last result shown rather than a full page further. The full ranking
+    is only computed when a cursor is first followed, then kept in memory under the token, so the
+    pages after it only format the next slice: the query isn't embedded and the index isn't searched
+    again. A ranking expires when it hasn't been paged through for ttl_seconds, and the least recently
+    used are dropped beyond max_searches. Repeating a search while its ranking is still kept hands out
+    the same token.
+    """
+    def __init__(self, page_size: int = 10, ttl_seconds: float = 300.0, max_searches: int = 256):
+        """
+        Args:
+            page_size: Number of results per page.
+            ttl_seconds: Seconds a ranking is kept after it was last used.
+            max_searches: Max number of rankings kept.
+        """
+        self.page_size = page_size
+        self.ttl_seconds = ttl_seconds
+        # Token -> ranking, and search key -> token of its latest ranking
+        self._rankings = LRUCache(max_searches)
+        self._tokens = LRUCache(max_searches)
+
+
+    def first_page(self, key: tuple, first: list[str], shown: int, more: bool, rank: Callable[[], list],
+                   format_page: Callable[[list], tuple[list[str], int]]) -> tuple[list[str], str | None]:
+        """
+        Start paging through a search from its first page.
+
+        Args:
+            key: Identifies the search (query, filters, index version...); a search with the same key
+                reuses the ranking while it's kept.
+            first: The first page, already formatted.
+            shown: Number of candidates the first page shows.
+            more: Whether there may be results after the first page.
+            rank: Returns every candidate the search can page through, best first, the first page's
+                included. Only called when the next page is asked for.
+            format_page: Formats one page of candidates as tool results, returns them and the number
+                of candidates they show (fewer than given when some had to be left out).
+
+        Returns:
+            The first page and the cursor of the next one, None if there are no more results.
+        """
+        if not more:
+            return first, None
+        token = self._tokens.get(key)
+        ranking = self._get(token) if token is not None else None
+        metrics.increment("pager_misses" if ranking is None else "pager_hits")
+        if ranking is None:
+            token = secrets.token_urlsafe(12)
+            ranking = {"items": None, "rank": rank, "format_page": format_page, "lock": threading.Lock()}
+            self._rankings.put(token, ranking)
+            self._tokens.put(key, token)
+        ranking["expires"] = time.time() + self.ttl_seconds
+        return first, f"{token}.{shown}"
+
+
+    def next_page(self, cursor: str) -> tuple[list[str], str | None]:
+        """
+        Format the page a cursor points to.
+
+        Returns:
+            The page and the cursor of the one after it, None if there are no more results.
+
+        Raises:
+            ValueError: If the cursor is malformed or its search has expired.
+        """
+        # Tokens are url-safe base64, which has no dots
+        token, _, offset = cursor.strip().rpartition(".")
+        ranking = self._get(token) if token and offset.isdigit() else None
+        if ranking is None:
+            metrics.increment("cursors_expired")
+            raise ValueError("This cursor has expired or is not valid. Run the search again without a cursor.")
+        return self._page(token, ranking, int(offset))
+
+
+    def _get(self, token: str) -> dict | None:
+        ranking = self._rankings.get(token)
+        if ranking is None or ranking["expires"] < time.time():
+            return None
+        return ranking
+
+
+    def _page(self, token: str, ranking: dict, offset: int) -> tuple[list[str], str | None]:
+        ranking["expires"] = time.time() + self.ttl_seconds
+        # Concurrent requests for the pages of one search rank it once
+        with ranking["lock"]:
+            if ranking["items"] is None:
+                ranking["items"] = ranking["rank"]()
+        items = ranking["items"][offset: offset + self.page_size]
+        results, shown = ranking["format_page"](items) if items else ([], 0)
+        next_offset = offset + shown
+        return results, f"{token}.{next_offset}" if next_offset < len(ranking["items"]) else None
@@ -0,0 +1,236 @@
+from src.retrieval_stuff.cache import LRUCache
+from bisect import bisect_left, bisect_right
+import json
+import os
+import re
+import threading
+import zlib
+
+PARENT_TEXT_FILE = "parents.bin"
+PARENT_INDEX_FILE = "parents.json"
+# Markdown headings, the sections a document can be read by
+HEADING_PATTERN = re.compile(r"^[ \t]*(#{1,6})[ \t]+(.+?)[ \t#]*$", re.MULTILINE)
+
+
+def _layout(chunks: list[str]) -> dict:
+    """
+    Where each chunk and section starts in the document text (the chunks joined by spaces).
+    """
+    starts, position = [], 0
+    for chunk in chunks:
+        starts.append(position)
+        position += len(chunk) + 1
+    starts.append(position)
+    sections = [[len(match.group(1)), match.group(2), match.start()] for match in HEADING_PATTERN.finditer(" ".join(chunks))]
+    return {"chars": starts, "sections": sections}
+
+
+class ParentStore:
+    """
+    Full text of every source document, stored as its chunks in order so any run of adjacent chunks
+    can be read back without touching the rest.
+
+    Texts live in one flat file of chunks, each compressed on its own with zlib; a small JSON index
+    maps each document id to the byte offsets of its chunks and to where its chunks and markdown
+    sections start in the text. Only the index is read when the store is opened, chunk text is read
+    from disk when asked for. Documents added or removed since the last save are kept in memory.
+    Stores written before compression was added are read as they are and compressed when next saved.
+    """
+    def __init__(self, cache_size: int = 1024):
+        """
+        Args:
+            cache_size: Max number of chunk runs kept in memory after being read.
+        """
+        self._path = None
+        self._compressed = True
+        self._index: dict[str, dict] = {}
+        self._pending: dict[str, list[str] | None] = {}
+        self._cache = LRUCache(cache_size)
+        self._lock = threading.Lock()
+
+
+    def __contains__(self, doc_id: str) -> bool:
+        with self._lock:
+            if doc_id in self._pending:
+                return self._pending[doc_id] is not None
+            return doc_id in self._index
+
+
+    def add(self, doc_id: str, chunks: list[str]):
+        """
+        Store a document as its chunks, ordered by chunk_index. Replaces any earlier version.
+        """
+        with self._lock:
+            self._pending[doc_id] = list(chunks)
+
+
+    def remove(self, doc_ids: list[str]):
+        with self._lock:
+            for doc_id in doc_ids:
+                self._pending[doc_id] = None
+
+
+    def num_chunks(self, doc_id: str) -> int:
+        with self._lock:
+            if doc_id in self._pending:
+                chunks = self._pending[doc_id]
+                return len(chunks) if chunks is not None else 0
+            entry = self._index.get(doc_id)
+            return len(entry["offsets"]) - 1 if entry else 0
+
+
+    def get_chunks(self, doc_id: str, start: int, end: int) -> str | None:
+        """
+        Chunks start..end (exclusive) of a document merged into one text, None for unknown documents.
+        """
+        with self._lock:
+            if doc_id in self._pending:
+                chunks = self._pending[doc_id]
+                return " ".join(chunks[max(start, 0): end]) if chunks is not None else None
+            entry = self._index.get(doc_id)
+        if entry is None:
+            return None
+
+        start, end = max(start, 0), min(end, len(entry["offsets"]) - 1)
+        if start >= end:
+            return ""
+        cache_key = (doc_id, start, end)
+        text = self._cache.get(cache_key)
+        if text is None:
+            text = " ".join(self._read_chunks(entry, start, end))
+            self._cache.put(cache_key, text)
+        return text
+
+
+    def _read_chunks(self, entry: dict, start: int, end: int) -> list[str]:
+        offsets = entry["offsets"]
+        with open(os.path.join(self._path, PARENT_TEXT_FILE), "rb") as f:
+            f.seek(offsets[start])
+            data = f.read(offsets[end] - offsets[start])
+        raw = [data[a - offsets[start]: b - offsets[start]] for a, b in zip(offsets[start:end], offsets[start + 1: end + 1])]
+        return [(zlib.decompress(chunk) if self._compressed else chunk).decode("utf-8") for chunk in raw]
+
+
+    def _get_layout(self, doc_id: str) -> dict | None:
+        with self._lock:
+            if doc_id in self._pending:
+                chunks = self._pending[doc_id]
+                return _layout(chunks) if chunks is not None else None
+            entry = self._index.get(doc_id)
+        if entry is None:
+            return None
+        if "chars" not in entry:
+            # Stores written before layouts were recorded
+            entry.update(_layout(self._read_chunks(entry, 0, len(entry["offsets"]) - 1)))
+        return entry
+
+
+    def length(self, doc_id: str) -> int | None:
+        """
+        Number of characters in a document's text, None for unknown documents.
+        """
+        layout = self._get_layout(doc_id)
+        if layout is None:
+            return None
+        return max(layout["chars"][-1] - 1, 0)
+
+
+    def get_text(self, doc_id: str, start: int = 0, end: int | None = None) -> str | None:
+        """
+        Characters start..end (exclusive) of a document's text, None for unknown documents.
+
+        Only the chunks overlapping the range are read and decompressed.
+        """
+        layout = self._get_layout(doc_id)
+        if layout is None:
+            return None
+        chars = layout["chars"]
+        start = max(start, 0)
+        end = chars[-1] if end is None else end
+        first = max(bisect_right(chars, start) - 1, 0)
+        last = min(bisect_left(chars, end), len(chars) - 1)
+        text = self.get_chunks(doc_id, first, last)
+        return text[start - chars[first]: end - chars[first]]
+
+
+    def sections(self, doc_id: str) -> list[dict]:
+        """
+        Markdown sections of a document: heading, level and character range, which runs to the next
+        heading of the same or a higher level. Empty for unknown documents and documents without headings.
+        """
+        layout = self._get_layout(doc_id)
+        if layout is None:
+            return []
+        headings = layout["sections"]
+        end_of_text = max(layout["chars"][-1] - 1, 0)
+        sections = []
+        for i, (level, title, start) in enumerate(headings):
+            end = next((other_start for other_level, _, other_start in headings[i + 1:] if other_level <= level), end_of_text)
+            sections.append({"title": title, "level": level, "start": start, "end": end})
+        return sections
+
+
+    def save(self, path: str):
+        """
+        Write every document, pending changes included, to a store directory.
+        """
+        with self._lock:
+            pending = dict(self._pending)
+            doc_ids = [doc_id for doc_id in self._index if doc_id not in pending]
+            doc_ids += [doc_id for doc_id, chunks in pending.items() if chunks is not None]
+
+        index, position = {}, 0
+        source = open(os.path.join(self._path, PARENT_TEXT_FILE), "rb") if self._path else None
+        try:
+            with open(os.path.join(path, PARENT_TEXT_FILE), "wb") as f:
+                for doc_id in doc_ids:
+                    if doc_id in pending:
+                        layout = _layout(pending[doc_id])
+                        encoded = [zlib.compress(chunk.encode("utf-8")) for chunk in pending[doc_id]]
+                    elif self._compressed:
+                        # Unchanged documents are copied across as raw bytes
+                        layout = self._get_layout(doc_id)
+                        offsets = self._index[doc_id]["offsets"]
+                        source.seek(offsets[0])
+                        data = source.read(offsets[-1] - offsets[0])
+                        encoded = [data[a - offsets[0]: b - offsets[0]] for a, b in zip(offsets, offsets[1:])]
+                    else:
+                        chunks = self._read_chunks(self._index[doc_id], 0, len(self._index[doc_id]["offsets"]) - 1)
+                        layout = _layout(chunks)
+                        encoded = [zlib.compress(chunk.encode("utf-8")) for chunk in chunks]
+                    chunk_offsets = [position]
+                    for data in encoded:
+                        f.write(data)
+                        position += len(data)
+                        chunk_offsets.append(position)
+                    index[doc_id] = {"offsets": chunk_offsets, "chars": layout["chars"], "sections": layout["sections"]}
+        finally:
+            if source is not None:
+                source.close()
+
+        with open(os.path.join(path, PARENT_INDEX_FILE), "w") as f:
+            json.dump({"compression": "zlib", "documents": index}, f)
+
+
+    @classmethod
+    def load(cls, path: str) -> "ParentStore":
+        """
+        Open a store directory. Only the offsets index is read into memory.
+        """
+        store = cls()
+        with open(os.path.join(path, PARENT_INDEX_FILE), "r") as f:
+            index = json.load(f)
+        if "documents" in index:
+            store._index = index["documents"]
+            store._compressed = index.get("compression") == "zlib"
+        else:
+            # Uncompressed store, written before compression was added
+            store._index = index
+            store._compressed = False
+        store._path = path
+        return store
+
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, PARENT_INDEX_FILE))
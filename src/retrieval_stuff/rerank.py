@@ -0,0 +1,123 @@
+from src.retrieval_stuff.cache import LRUCache
+from src.retrieval_stuff.embedding import load_cached_model
+from src.retrieval_stuff.metrics import metrics
+from llama_index.core.schema import NodeWithScore
+from sentence_transformers import CrossEncoder
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """
+    Reorders retrieved candidates with a small local cross-encoder.
+
+    All uncached (query, chunk) pairs are scored in a single batch. If scoring doesn't finish within the
+    latency budget the candidates are returned in their original vector order and the caller is told,
+    so the fallback isn't cached as a reranked result; a batch already running keeps going in the
+    background and its scores land in the pair cache, so a repeat of the query is reranked. Batches
+    still queued when their caller gives up are dropped, and at most max_queued batches wait behind
+    the running one; beyond that a query falls back to vector order straight away, so a slow batch
+    never builds up a backlog that makes every later query time out too.
+    """
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+                 candidate_pool: int = 30,
+                 latency_budget_ms: float = 200.0,
+                 cache_size: int = 4096,
+                 max_length: int = 512,
+                 max_queued: int = 2,
+                 offline: bool = False):
+        """
+        Args:
+            model_name: sentence-transformers CrossEncoder model.
+            candidate_pool: Number of vector search results handed to the cross-encoder.
+            latency_budget_ms: Max time to wait for scores before falling back to the vector order.
+            cache_size: Max number of (query, chunk) scores kept.
+            max_length: Max tokens per (query, chunk) pair; longer chunks are truncated.
+            max_queued: Max batches waiting for the model while another one runs.
+            offline: Fail rather than download the model if it isn't in the local cache.
+        """
+        self.model_name = model_name
+        self.candidate_pool = candidate_pool
+        self.latency_budget_ms = latency_budget_ms
+        self.max_length = max_length
+        self.max_queued = max_queued
+        self.offline = offline
+        self.pair_cache = LRUCache(cache_size)
+        self.timeouts = 0
+        self._model = None
+        self._model_lock = threading.Lock()
+        # One worker: batches are already as large as they get, and a backlog behind a slow batch
+        # should fall back to vector order rather than pile up.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._queued = 0
+        self._queue_lock = threading.Lock()
+
+
+    def _get_model(self):
+        with self._model_lock:
+            if self._model is None:
+                logger.info(f"Loading cross-encoder {self.model_name}...")
+                self._model = load_cached_model(CrossEncoder, self.model_name, offline=self.offline, max_length=self.max_length)
+            return self._model
+
+
+    def load(self) -> "CrossEncoderReranker":
+        """
+        Load the model now rather than on the first reranked query, and run it once so its lazy setup is done too.
+        """
+        self._get_model().predict([("warm up", "warm up")], show_progress_bar=False)
+        return self
+
+
+    def _run_queued(self, query: str, nodes: list[NodeWithScore]) -> list[float]:
+        with self._queue_lock:
+            self._queued -= 1
+        return self._score(query, nodes)
+
+
+    def _score(self, query: str, nodes: list[NodeWithScore]) -> list[float]:
+        pairs = [(query, node.node.get_content()) for node in nodes]
+        scores = self._get_model().predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        for node, score in zip(nodes, scores):
+            self.pair_cache.put((query, node.node.node_id), float(score))
+        return [float(score) for score in scores]
+
+
+    def rerank(self, query: str, nodes: list[NodeWithScore]) -> tuple[list[NodeWithScore], bool]:
+        """
+        Returns:
+            The nodes best first, and whether they were reranked: False when scoring ran over the latency
+            budget and the nodes were kept in their original order, with their original scores.
+        """
+        if not nodes:
+            return nodes, True
+
+        scores = [self.pair_cache.get((query, node.node.node_id)) for node in nodes]
+        missing = [node for node, score in zip(nodes, scores) if score is None]
+        metrics.increment("rerank_cache_hits", len(nodes) - len(missing))
+        metrics.increment("rerank_cache_misses", len(missing))
+        if missing:
+            with self._queue_lock:
+                if self._queued >= self.max_queued:
+                    metrics.increment("rerank_skipped")
+                    return nodes, False
+                self._queued += 1
+            future = self._executor.submit(self._run_queued, query, missing)
+            try:
+                missing_scores = iter(future.result(timeout=self.latency_budget_ms / 1000))
+            except TimeoutError:
+                # Nobody is waiting for this batch anymore; drop it unless it already started
+                if future.cancel():
+                    with self._queue_lock:
+                        self._queued -= 1
+                self.timeouts += 1
+                metrics.increment("rerank_timeouts")
+                logger.warning(f"Reranking exceeded {self.latency_budget_ms}ms, keeping vector order.")
+                return nodes, False
+            scores = [next(missing_scores) if score is None else score for score in scores]
+
+        reranked = sorted(zip(nodes, scores), key=lambda pair: pair[1], reverse=True)
+        return [NodeWithScore(node=node.node, score=score) for node, score in reranked], True
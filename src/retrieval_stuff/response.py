@@ -0,0 +1,152 @@
+from src.retrieval_stuff.cache import LRUCache
+from src.retrieval_stuff.index import get_document_id
+from src.retrieval_stuff.metrics import metrics
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import NodeWithScore
+import numpy as np
+import re
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+RESULT_TEMPLATE = "File Path: {}\n -----------\n Title: {}\n -----------\n Document id: {}\n -----------\n Content: {}"
+TRUNCATION_MARKER = "[...]"
+# Ends the last result when lower ranked results were dropped to fit the budget
+OMITTED_NOTE = " more results omitted to fit the response size limit. Use a more specific query to see them.]"
+# Replaces it when the response has a cursor, as the next page starts at the omitted results
+OMITTED_PAGED_NOTE = " more results omitted to fit the response size limit. They start the next page.]"
+# Rough conversion for budgets given in tokens; close enough for English prose and markdown
+CHARS_PER_TOKEN = 4
+
+
+def split_sentences(text: str) -> list[str]:
+    return [sentence.strip() for sentence in SENTENCE_PATTERN.split(text) if sentence.strip()]
+
+
+class ResponseBuilder:
+    """
+    Formats retrieved chunks into tool results that fit a size budget.
+
+    Results that fit their share of the budget are returned whole. Longer ones are cut down to their
+    sentences most similar to the query, in document order, with markers where text was left out and
+    a note saying which document to fetch for the full text. Sentences are compared against the query
+    embedding the search already computed; their own embeddings are cached per model, as the same
+    chunks keep coming back for related queries.
+    """
+    def __init__(self, max_tokens: int = 4000, min_result_chars: int = 300, sentence_cache_size: int = 20_000):
+        """
+        Args:
+            max_tokens: Budget for all results of one query together.
+            min_result_chars: Smallest useful snippet; lower ranked results are dropped rather than cut shorter.
+            sentence_cache_size: Max number of (model, sentence) embeddings kept.
+        """
+        self.max_chars = max_tokens * CHARS_PER_TOKEN
+        self.min_result_chars = min_result_chars
+        self.sentence_cache = LRUCache(sentence_cache_size)
+
+
+    def build(self, nodes: list[NodeWithScore], query_embedding: list[float], embed_model: BaseEmbedding,
+              labels: list[str] | None = None) -> list[str]:
+        """
+        Args:
+            nodes: Retrieved nodes, best first.
+            query_embedding: Embedding of the query the nodes were retrieved for.
+            embed_model: Model the query was embedded with, used for the sentences.
+            labels: Optional prefix per node, e.g. the source it came from.
+        """
+        labels = labels or [""] * len(nodes)
+        headers = [
+            label + RESULT_TEMPLATE.format(node.node.metadata.get("file_path", "Unknown"), node.node.metadata.get("title", "Unknown"),
+                                           get_document_id(node.node), "")
+            for label, node in zip(labels, nodes)
+        ]
+
+        # Drop the lowest ranked results until every remaining one fits or gets a useful snippet
+        lengths = [len(node.node.text) for node in nodes]
+        count = len(nodes)
+        while True:
+            budgets = self._allocate(lengths[:count], self.max_chars - sum(map(len, headers[:count])))
+            if count <= 1 or all(budget >= min(length, self.min_result_chars) for budget, length in zip(budgets, lengths)):
+                break
+            count -= 1
+
+        truncated = [i for i in range(count) if len(nodes[i].node.text) > budgets[i]]
+        sentences = {i: split_sentences(nodes[i].node.text) for i in truncated}
+        similarities = self._similarities([s for i in truncated for s in sentences[i]], query_embedding, embed_model)
+
+        results, offset = [], 0
+        for i in range(count):
+            text = nodes[i].node.text
+            if i in sentences:
+                text = self._snippet(nodes[i], sentences[i], similarities[offset: offset + len(sentences[i])], budgets[i])
+                offset += len(sentences[i])
+            results.append(headers[i] + text)
+        if count < len(nodes):
+            results.append(f"[{len(nodes) - count}{OMITTED_NOTE}")
+        return results
+
+
+    @staticmethod
+    def _allocate(lengths: list[int], budget: int) -> list[int]:
+        # Short results take only what they need, the rest is shared evenly among the longer ones
+        allocation = [0] * len(lengths)
+        remaining = max(budget, 0)
+        for filled, i in enumerate(sorted(range(len(lengths)), key=lambda i: lengths[i])):
+            allocation[i] = min(lengths[i], remaining // (len(lengths) - filled))
+            remaining -= allocation[i]
+        return allocation
+
+
+    def _similarities(self, sentences: list[str], query_embedding: list[float], embed_model: BaseEmbedding) -> np.ndarray:
+        if not sentences:
+            return np.zeros(0, dtype=np.float32)
+        # Embeddings of different models can't be compared, so the model is part of the key
+        model_name = embed_model.model_name
+        embeddings = [self.sentence_cache.get((model_name, sentence)) for sentence in sentences]
+        misses = sum(embedding is None for embedding in embeddings)
+        metrics.increment("sentence_cache_hits", len(sentences) - misses)
+        metrics.increment("sentence_cache_misses", misses)
+        missing = list(dict.fromkeys(sentence for sentence, embedding in zip(sentences, embeddings) if embedding is None))
+        if missing:
+            metrics.increment("embedded_sentences", len(missing))
+            with metrics.timer("embed_snippets"):
+                new_embeddings = dict(zip(missing, embed_model.get_text_embedding_batch(missing)))
+            for sentence, embedding in new_embeddings.items():
+                self.sentence_cache.put((model_name, sentence), embedding)
+            embeddings = [new_embeddings[sentence] if embedding is None else embedding
+                          for sentence, embedding in zip(sentences, embeddings)]
+
+        embeddings = np.array(embeddings, dtype=np.float32)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        query = np.array(query_embedding, dtype=np.float32)
+        return embeddings @ (query / max(np.linalg.norm(query), 1e-12))
+
+
+    def _snippet(self, node: NodeWithScore, sentences: list[str], similarities: np.ndarray, budget: int) -> str:
+        note = f" [Truncated: {len(node.node.text)} characters in full. get_document(\"{get_document_id(node.node)}\") returns the whole document]"
+        budget = max(budget - len(note), 0)
+
+        cut = max(budget - len(TRUNCATION_MARKER) - 1, 0)
+        if not sentences:
+            # Nothing but whitespace to pick from, keep the start of the text
+            return (node.node.text[:cut].strip() + " " + TRUNCATION_MARKER).strip() + note
+
+        chosen, used = set(), 0
+        for i in np.argsort(-similarities):
+            cost = len(sentences[i]) + len(TRUNCATION_MARKER) + 2
+            if used + cost > budget:
+                continue
+            chosen.add(int(i))
+            used += cost
+        if not chosen:
+            # Even the best sentence is too long, keep its start
+            best = int(np.argmax(similarities))
+            return (sentences[best][:cut] + " " + TRUNCATION_MARKER).strip() + note
+
+        parts, previous = [], -1
+        for i in sorted(chosen):
+            if i != previous + 1:
+                parts.append(TRUNCATION_MARKER)
+            parts.append(sentences[i])
+            previous = i
+        if previous != len(sentences) - 1:
+            parts.append(TRUNCATION_MARKER)
+        return " ".join(parts) + note
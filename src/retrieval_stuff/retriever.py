@@ -1,6 +1,35 @@
-from src.retrieval_stuff.index import HuggingFaceVectorStoreIndex, Index
-from llama_index.core.schema import NodeWithScore
+from src.retrieval_stuff.index import HuggingFaceVectorStoreIndex, Index, get_document_id
+from src.retrieval_stuff.cache import LRUCache
+from src.retrieval_stuff.rerank import CrossEncoderReranker
+from src.retrieval_stuff.embedding import embed_queries
+from src.retrieval_stuff.diversity import select_diverse
+from src.retrieval_stuff.response import ResponseBuilder, RESULT_TEMPLATE
+from src.retrieval_stuff.semantic_cache import SemanticQueryCache
+from src.retrieval_stuff.metrics import metrics
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
 from llama_index.core.retrievers import BaseRetriever
+from concurrent.futures import Future, ThreadPoolExecutor
+import json
+import numpy as np
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Collapse trivially different spellings of a query (case, surrounding/repeated whitespace) to one cache key.
+    """
+    return re.sub(r"\s+", " ", query).strip().casefold()
+
+
+def filter_key(filters: dict[str, str] | None) -> tuple:
+    """
+    Hashable form of a filters dict for cache keys; unset filters are dropped.
+    """
+    return tuple(sorted((key, value) for key, value in (filters or {}).items() if value))
 
 
 
@@ -8,44 +37,421 @@ class Retriever:
     def __init__(self, index: Index, top_k: int = 10):
         raise NotImplementedError("Subclasses must implement this method")
     
-    def retrieve(self, query: str, rerank: bool = False, top_k: int = None) -> list[str]:
+    def retrieve(self, query: str, rerank: bool = False, top_k: int = None, filters: dict[str, str] | None = None) -> list[str]:
         raise NotImplementedError("Subclasses must implement this method")
     
+    def retrieve_many(self, queries: list[str], rerank: bool = False, top_k: int = None,
+                      filters: dict[str, str] | None = None) -> list[list[str]]:
+        return [self.retrieve(query, rerank=rerank, top_k=top_k, filters=filters) for query in queries]
+    
     def build_retriever(self) -> BaseRetriever:
         raise NotImplementedError("Subclasses must implement this method")
     
-    def rerank(self, retrieved_nodes: list[NodeWithScore]) -> list[str]:
+    def rerank(self, retrieved_nodes: list[NodeWithScore], query: str) -> tuple[list[NodeWithScore], bool]:
         raise NotImplementedError("Subclasses must implement this method")
     
 
-# TODO: maybe make a hybrid one?
 class HuggingFaceVectorRetriever(Retriever):
-    def __init__(self, index: HuggingFaceVectorStoreIndex, top_k: int = 10):
+    # What the scores of retrieved nodes are; scores of different kinds can't be compared
+    score_kind = "cosine"
+
+    def __init__(self, index: HuggingFaceVectorStoreIndex, top_k: int = 10,
+                 embedding_cache_size: int = 1024, result_cache_size: int = 256,
+                 reranker: CrossEncoderReranker | None = None,
+                 mmr_lambda: float | None = None, max_per_document: int | None = None, diversity_pool: int = 30,
+                 response_builder: ResponseBuilder | None = None, context_window: int = 0,
+                 semantic_cache: SemanticQueryCache | None = None):
+        """
+        Args:
+            embedding_cache_size: Max number of normalized queries whose embeddings are kept.
+            result_cache_size: Max number of (query, top_k, rerank, index version) results kept.
+            reranker: Used by retrieve(rerank=True). Without one, rerank keeps the vector order.
+            mmr_lambda: If set, pick results by maximal marginal relevance (1.0 = pure relevance, 0.0 = pure novelty).
+            max_per_document: Max chunks of one source document in the results.
+            diversity_pool: Number of candidates fetched to pick diverse results from, when either option is set.
+            response_builder: Fits results into a size budget. Without one, full chunk texts are returned.
+            context_window: Return each hit together with this many neighbouring chunks on either side,
+                read from the index's parent store. Hits whose windows touch are merged into one result.
+            semantic_cache: Persistent cache consulted after the in-memory result cache; near-duplicate
+                queries get the results of an earlier one without searching.
+        """
         assert isinstance(index, HuggingFaceVectorStoreIndex), "Index must be a HuggingFaceVectorStoreIndex"
         
         self.index = index
         self.top_k = top_k
-        self.retriever = self.build_retriever()
+        self.reranker = reranker
+        self.mmr_lambda = mmr_lambda
+        self.max_per_document = max_per_document
+        self.diversity_pool = diversity_pool
+        self.response_builder = response_builder
+        self.context_window = context_window
+        self.semantic_cache = semantic_cache
+        self._purged_version = None
+        # LlamaIndex retrievers by top_k, built on first use: DirectRetriever only needs them for the
+        # queries it can't serve directly, and filtered searches never use them
+        self._retriever = None
+        self._retrievers = {}
+        self.embedding_cache = LRUCache(embedding_cache_size)
+        self.result_cache = LRUCache(result_cache_size)
+        self.warmup_stats = None
+
+    def retrieve(self, query: str, rerank: bool = False, top_k: int = None, filters: dict[str, str] | None = None) -> list[str]:
+        """
+        Args:
+            filters: Restrict the search to chunks matching these filters, see HuggingFaceVectorStoreIndex.get_filter_ids.
+        """
+        normalized_query = normalize_query(query)
+        # The index version and content id are part of the key, so results never outlive a reload or an upsert
+        cache_key = (normalized_query, top_k, rerank, filter_key(filters), self.index.version, self.index.content_id)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        retrieved_nodes, score_kind = self.retrieve_scored(query, rerank=rerank, top_k=top_k, filters=filters)
+        with metrics.timer("format"):
+            results = self._format_results(retrieved_nodes, normalized_query)
+        # A reranking that timed out isn't cached, so a repeat of the query gets reranked
+        if score_kind == self.score_kind_for(rerank):
+            self._put_cached(cache_key, tuple(results))
+        return results
+
+    def retrieve_many(self, queries: list[str], rerank: bool = False, top_k: int = None,
+                      filters: dict[str, str] | None = None) -> list[list[str]]:
+        """
+        Retrieve results for several queries at once.
+
+        Uncached queries are embedded in one batch and searched with a single multi-query FAISS call,
+        which is much cheaper than one model call and one search per query.
+
+        Returns:
+            One result list per query, in the same order as queries.
+        """
+        normalized_queries = [normalize_query(query) for query in queries]
+        cache_keys = [(normalized, top_k, rerank, filter_key(filters), self.index.version, self.index.content_id)
+                      for normalized in normalized_queries]
+        results = [self._get_cached(cache_key) for cache_key in cache_keys]
+        # Duplicates in the batch are only searched once
+        first_index = {}
+        for i, normalized in enumerate(normalized_queries):
+            first_index.setdefault(normalized, i)
+        missing = [i for i in first_index.values() if results[i] is None]
+
+        if missing:
+            logger.debug(f"Retrieving {self.top_k} documents for {len(missing)} queries...")
+            allowed_ids = self._allowed_ids(filters)
+            node_lists = self._retrieve_nodes_many(
+                [queries[i] for i in missing], [normalized_queries[i] for i in missing], self._pool_size(rerank, top_k), allowed_ids)
+            for i, retrieved_nodes in zip(missing, node_lists):
+                retrieved_nodes, score_kind = self._select(retrieved_nodes, normalized_queries[i], rerank, top_k)
+                with metrics.timer("format"):
+                    results[i] = tuple(self._format_results(retrieved_nodes, normalized_queries[i]))
+                if score_kind == self.score_kind_for(rerank):
+                    self._put_cached(cache_keys[i], results[i])
+
+        return [list(results[first_index[normalized]]) for normalized in normalized_queries]
 
-    def retrieve(self, query: str, rerank: bool = False, top_k: int = None) -> list[str]:
-        print(f"Retrieving {self.top_k} documents for query: '{query}'...")
-        retrieved_nodes = self.retriever.retrieve(query)
-        print(f"Retrieved {len(retrieved_nodes)} documents.")
+    def _semantic_params(self, cache_key: tuple) -> str:
+        # Everything besides the query and index version that changes the results. The index's content id
+        # rather than its revision, which restarts at 0 in every process sharing the cache
+        _, top_k, rerank, filters, _, content_id = cache_key
+        builder_chars = self.response_builder.max_chars if self.response_builder else None
+        return json.dumps([type(self).__name__, self.top_k, top_k, rerank, filters, content_id, self.mmr_lambda,
+                           self.max_per_document, self.context_window, builder_chars, RESULT_TEMPLATE])
+
+    def _get_cached(self, cache_key: tuple) -> tuple[str, ...] | None:
+        cached = self.result_cache.get(cache_key)
+        metrics.increment("result_cache_misses" if cached is None else "result_cache_hits")
+        if cached is None and self.semantic_cache is not None:
+            normalized_query = cache_key[0]
+            embedding = self.embed_query(normalized_query)
+            with metrics.timer("semantic_cache"):
+                cached = self.semantic_cache.get(
+                    embedding, self.index.index_name, str(self.index.version), self._semantic_params(cache_key))
+            metrics.increment("semantic_cache_misses" if cached is None else "semantic_cache_hits")
+            if cached is not None:
+                self.result_cache.put(cache_key, cached)
+        return cached
+
+    def _put_cached(self, cache_key: tuple, results: tuple[str, ...]):
+        self.result_cache.put(cache_key, results)
+        if self.semantic_cache is not None:
+            if self._purged_version != self.index.version:
+                self.semantic_cache.purge(self.index.index_name, str(self.index.version))
+                self._purged_version = self.index.version
+            normalized_query = cache_key[0]
+            self.semantic_cache.put(self.embed_query(normalized_query), self.index.index_name, str(self.index.version),
+                                    self._semantic_params(cache_key), normalized_query, results)
+
+    def retrieve_nodes(self, query: str, rerank: bool = False, top_k: int = None,
+                       filters: dict[str, str] | None = None) -> list[NodeWithScore]:
+        """
+        Retrieve nodes with their scores, higher is better.
+
+        Args:
+            top_k: Overrides the number of results; may be larger than the retriever's top_k, e.g. to rank
+                the results of several pages at once.
+        """
+        return self.retrieve_scored(query, rerank=rerank, top_k=top_k, filters=filters)[0]
+
+    def retrieve_scored(self, query: str, rerank: bool = False, top_k: int = None,
+                        filters: dict[str, str] | None = None) -> tuple[list[NodeWithScore], str]:
+        """
+        Same as retrieve_nodes, along with the kind of score the nodes carry. That is score_kind_for(rerank),
+        except when reranking timed out and the nodes kept their original order and scores.
+
+        With a top_k above the retriever's, the first results are exactly what a search without it returns:
+        reranking and diversity selection only run on the usual candidate pool, and the other candidates
+        follow in vector order with their vector scores. So a deep ranking costs one larger FAISS search,
+        not a larger rerank, and its first page matches the cached results of the same query.
+        """
+        normalized_query = normalize_query(query)
+        logger.debug(f"Retrieving {top_k or self.top_k} documents for query: '{query}'...")
+        pool_size = self._pool_size(rerank)
+        retrieved_nodes = self._retrieve_nodes(query, normalized_query, max(pool_size, top_k or 0), self._allowed_ids(filters))
+        logger.debug(f"Retrieved {len(retrieved_nodes)} documents.")
+        if not top_k or top_k <= self.top_k:
+            return self._select(retrieved_nodes, normalized_query, rerank, top_k)
+        selected, score_kind = self._select(retrieved_nodes[: pool_size], normalized_query, rerank)
+        return selected + self._remaining(retrieved_nodes, selected, top_k - len(selected)), score_kind
+
+    def score_kind_for(self, rerank: bool) -> str:
+        """
+        Kind of score retrieve_nodes gives its nodes: cross-encoder scores when reranking, otherwise score_kind.
+        """
+        return "cross-encoder" if rerank and self.reranker is not None else self.score_kind
+
+    def format_nodes(self, retrieved_nodes: list[NodeWithScore], query: str) -> list[str]:
+        """
+        Format nodes returned by retrieve_nodes as tool results.
+        """
+        with metrics.timer("format"):
+            return self._format_results(retrieved_nodes, normalize_query(query))
+
+    def _allowed_ids(self, filters: dict[str, str] | None) -> np.ndarray | None:
+        if not filter_key(filters):
+            return None
+        return self.index.get_filter_ids(filters)
+
+    def _pool_size(self, rerank: bool, top_k: int = None) -> int:
+        # Reranking and diversity selection both pick the top_k from a larger pool of candidates
+        pool_size = max(self.top_k, top_k or 0)
+        if rerank and self.reranker:
+            pool_size = max(pool_size, self.reranker.candidate_pool)
+        if self.mmr_lambda is not None or self.max_per_document is not None:
+            pool_size = max(pool_size, self.diversity_pool)
+        return pool_size
+
+    def _select(self, retrieved_nodes: list[NodeWithScore], normalized_query: str, rerank: bool,
+                top_k: int = None) -> tuple[list[NodeWithScore], str]:
+        top_k = top_k or self.top_k
+        score_kind = self.score_kind
         if rerank:
-            retrieved_nodes = self.rerank(retrieved_nodes)
-            print(f"Reranked {len(retrieved_nodes)} documents.")
-        if top_k is not None:
+            with metrics.timer("rerank"):
+                retrieved_nodes, reranked = self.rerank(retrieved_nodes, normalized_query)
+            if reranked:
+                score_kind = "cross-encoder"
+                logger.debug(f"Reranked {len(retrieved_nodes)} documents.")
+        if self.mmr_lambda is None and self.max_per_document is None:
             retrieved_nodes = retrieved_nodes[: top_k]
-        
-        return self._parse_results(retrieved_nodes)
+        else:
+            # MMR compares the candidates' stored vectors, so it costs no extra embedding or search
+            with metrics.timer("diversify"):
+                vectors = None
+                if self.mmr_lambda is not None:
+                    vectors = self.index.get_vectors([node.node.node_id for node in retrieved_nodes])
+                retrieved_nodes = select_diverse(retrieved_nodes, vectors, top_k, self.mmr_lambda, self.max_per_document)
+        if self.context_window > 0:
+            with metrics.timer("expand_context"):
+                retrieved_nodes = self._expand_context(retrieved_nodes)
+        return retrieved_nodes, score_kind
+
+    def _remaining(self, retrieved_nodes: list[NodeWithScore], selected: list[NodeWithScore], count: int) -> list[NodeWithScore]:
+        """
+        Up to count candidates that weren't selected, in vector order, for the results after the selected ones.
+        """
+        shown = {node.node.node_id for node in selected}
+        per_document = {}
+        if self.max_per_document is not None:
+            for node in selected:
+                doc_id = get_document_id(node.node)
+                per_document[doc_id] = per_document.get(doc_id, 0) + 1
+        remaining = []
+        for node in retrieved_nodes:
+            if len(remaining) >= count:
+                break
+            if node.node.node_id in shown:
+                continue
+            if self.max_per_document is not None:
+                doc_id = get_document_id(node.node)
+                if per_document.get(doc_id, 0) >= self.max_per_document:
+                    continue
+                per_document[doc_id] = per_document.get(doc_id, 0) + 1
+            remaining.append(node)
+        if self.context_window > 0 and remaining:
+            with metrics.timer("expand_context"):
+                remaining = self._expand_context(remaining)
+        return remaining
+
+    def _expand_context(self, retrieved_nodes: list[NodeWithScore]) -> list[NodeWithScore]:
+        """
+        Replace each hit with the run of chunks around it, merging hits from the same document whose runs touch.
+        """
+        parent_store = self.index.get_parent_store()
+        windows: dict[str, list[dict]] = {}
+        expanded = []
+        for node in retrieved_nodes:
+            doc_id = get_document_id(node.node)
+            chunk_index = node.node.metadata.get("chunk_index")
+            if chunk_index is None or doc_id not in parent_store:
+                expanded.append(node)
+                continue
+            start = max(chunk_index - self.context_window, 0)
+            end = min(chunk_index + self.context_window + 1, parent_store.num_chunks(doc_id))
+            for window in windows.get(doc_id, []):
+                if start <= window["end"] and end >= window["start"]:
+                    window["start"], window["end"] = min(start, window["start"]), max(end, window["end"])
+                    break
+            else:
+                # Merged results keep the rank of their best hit
+                window = {"doc_id": doc_id, "start": start, "end": end, "node": node}
+                windows.setdefault(doc_id, []).append(window)
+                expanded.append(window)
+
+        results = []
+        for item in expanded:
+            if isinstance(item, NodeWithScore):
+                results.append(item)
+                continue
+            node = item["node"].node
+            text = parent_store.get_chunks(item["doc_id"], item["start"], item["end"])
+            metadata = dict(node.metadata, chunk_start=item["start"], chunk_end=item["end"])
+            results.append(NodeWithScore(
+                node=TextNode(id_=node.node_id, text=text or node.text, metadata=metadata,
+                              excluded_embed_metadata_keys=node.excluded_embed_metadata_keys,
+                              excluded_llm_metadata_keys=node.excluded_llm_metadata_keys),
+                score=item["node"].score))
+        return results
+
+    def _retrieve_nodes(self, query: str, normalized_query: str, top_k: int,
+                        allowed_ids: np.ndarray | None = None) -> list[NodeWithScore]:
+        if allowed_ids is not None:
+            # LlamaIndex's FAISS store can't filter, search the store directly
+            return self._dense_nodes_many([normalized_query], top_k, allowed_ids)[0]
+        query_bundle = QueryBundle(query_str=query, embedding=self.embed_query(normalized_query))
+        start, searched = time.perf_counter(), metrics.thread_total("search")
+        try:
+            nodes = self._get_retriever(top_k).retrieve(query_bundle)
+        except (KeyError, ValueError):
+            # A concurrent upsert or delete changed the store between the FAISS search and the docstore
+            # lookup, which LlamaIndex doesn't tolerate; the direct search skips ids without a node
+            return self._dense_nodes_many([normalized_query], top_k)[0]
+        # LlamaIndex fetches the hits from the docstore right after the FAISS search; count that part as the lookup
+        metrics.observe("lookup", time.perf_counter() - start - (metrics.thread_total("search") - searched))
+        # FAISS returns squared L2 distances; for the normalized embeddings we store that is 2 - 2 * cosine,
+        # so convert back to a cosine similarity that can be compared across indexes.
+        for node in nodes:
+            node.score = 1.0 - node.score / 2.0
+        return nodes
+
+    def _retrieve_nodes_many(self, queries: list[str], normalized_queries: list[str], top_k: int,
+                             allowed_ids: np.ndarray | None = None) -> list[list[NodeWithScore]]:
+        return self._dense_nodes_many(normalized_queries, top_k, allowed_ids)
+
+    def _dense_nodes_many(self, normalized_queries: list[str], top_k: int,
+                          allowed_ids: np.ndarray | None = None) -> list[list[NodeWithScore]]:
+        """
+        Vector search only, straight on the FAISS store. Subclasses that add other searches build on this.
+        """
+        if allowed_ids is not None and len(allowed_ids) == 0:
+            return [[] for _ in normalized_queries]
+        embeddings = np.array(self.embed_queries(normalized_queries), dtype="float32")
+        dists, ids = self.index.index.vector_store.search(embeddings, top_k, allowed_ids)
+        node_lists = []
+        with metrics.timer("lookup"):
+            for query_dists, query_ids in zip(dists, ids):
+                found = query_ids >= 0
+                nodes = self.index.get_nodes(query_ids[found].tolist())
+                # Same cosine similarity as _retrieve_nodes
+                node_lists.append([
+                    NodeWithScore(node=node, score=1.0 - float(dist) / 2.0)
+                    for node, dist in zip(nodes, query_dists[found]) if node is not None
+                ])
+        return node_lists
+
+    @property
+    def retriever(self) -> BaseRetriever:
+        if self._retriever is None:
+            retriever = self.build_retriever()
+            self._retriever = self._retrievers.setdefault(retriever.similarity_top_k, retriever)
+        return self._retriever
+
+    def _get_retriever(self, top_k: int) -> BaseRetriever:
+        retriever = self._retrievers.get(top_k)
+        if retriever is None:
+            retriever = self._retrievers[top_k] = self.index.index.as_retriever(similarity_top_k=top_k)
+        return retriever
+
+    def embed_query(self, normalized_query: str) -> list[float]:
+        return self.embed_queries([normalized_query])[0]
+
+    def embed_queries(self, normalized_queries: list[str]) -> list[list[float]]:
+        embeddings = [self.embedding_cache.get(normalized_query) for normalized_query in normalized_queries]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        metrics.increment("embedding_cache_hits", len(embeddings) - len(missing))
+        metrics.increment("embedding_cache_misses", len(missing))
+        new_embeddings = embed_queries(self.index.storage_context.embed_model, [normalized_queries[i] for i in missing])
+        for i, embedding in zip(missing, new_embeddings):
+            embeddings[i] = embedding
+            self.embedding_cache.put(normalized_queries[i], embedding)
+        return embeddings
+
+    def clear_cache(self):
+        self.embedding_cache.clear()
+        self.result_cache.clear()
+
+    def close(self):
+        """
+        Release what this retriever owns once it stops serving, e.g. after a hot reload. Queries already
+        running on it still finish; the reranker, response builder and semantic cache passed in are shared
+        with other retrievers and left alone.
+        """
+        self.index.close()
+
+    def warm_up(self, queries: list[str], rerank: bool = False) -> dict[str, float]:
+        """
+        Run queries through the whole search path so the slow first-call work (tokenizer setup, first
+        allocations, kernel selection) is done before real queries arrive. Nothing is left in the caches.
+
+        Returns:
+            Latency in ms of the first (cold) query and the median of the others (warm).
+        """
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            normalized_query = normalize_query(query)
+            self._format_results(self.retrieve_nodes(query, rerank=rerank), normalized_query)
+            timings.append((time.perf_counter() - start) * 1000)
+        self.clear_cache()
+        self.warmup_stats = {
+            "cold_ms": timings[0] if timings else None,
+            "warm_ms": float(np.median(timings[1:])) if len(timings) > 1 else None
+        }
+        return self.warmup_stats
+    
+    def _format_results(self, retrieved_nodes: list[NodeWithScore], normalized_query: str) -> list[str]:
+        if self.response_builder is None:
+            return self._parse_results(retrieved_nodes)
+        # The query embedding is cached from the search, so snippet selection only embeds sentences
+        return self.response_builder.build(
+            retrieved_nodes, self.embed_query(normalized_query), self.index.storage_context.embed_model)
     
     def _parse_results(self, retrieved_nodes: list[NodeWithScore]) -> list[str]:
         results = []
         for node in retrieved_nodes:
-            doc = "File Path: {}\n -----------\n Title: {}\n -----------\n Content: {}"
-            doc = doc.format(
+            doc = RESULT_TEMPLATE.format(
                 node.node.metadata.get("file_path", "Unknown"), 
                 node.node.metadata.get("title", "Unknown"), 
+                get_document_id(node.node),
                 node.node.text)
             results.append(doc)
         return results
@@ -54,9 +460,94 @@ class HuggingFaceVectorRetriever(Retriever):
     def build_retriever(self) -> BaseRetriever:
         return self.index.index.as_retriever(similarity_top_k=self.top_k)
 
-    def rerank(self, retrieved_nodes: list[NodeWithScore]) -> list[str]:
-        return retrieved_nodes
+    def rerank(self, retrieved_nodes: list[NodeWithScore], query: str) -> tuple[list[NodeWithScore], bool]:
+        """
+        Returns:
+            The nodes best first, and whether the reranker reordered them.
+        """
+        if self.reranker is None:
+            return retrieved_nodes, False
+        return self.reranker.rerank(query, retrieved_nodes)
+
+
+
+class HybridRetriever(HuggingFaceVectorRetriever):
+    """
+    Dense + BM25 retrieval merged with reciprocal rank fusion.
+
+    Dense search handles paraphrases, the lexical index catches exact identifiers (service names,
+    error codes, flag names) that embeddings blur together. The BM25 search runs on a worker thread
+    while the query is embedded and searched in FAISS, so it adds little to the query latency.
+    """
+    score_kind = "rrf"
+
+    def __init__(self, index: HuggingFaceVectorStoreIndex, top_k: int = 10,
+                 candidate_pool: int = 50, rrf_k: int = 60, **kwargs):
+        """
+        Args:
+            candidate_pool: How many results to take from each of the dense and lexical searches before fusing.
+            rrf_k: Reciprocal rank fusion constant; larger values flatten the difference between ranks.
+        """
+        self.candidate_pool = max(candidate_pool, top_k)
+        self.rrf_k = rrf_k
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hybrid")
+        super().__init__(index, top_k=top_k, **kwargs)
+
+    def build_retriever(self) -> BaseRetriever:
+        return self.index.index.as_retriever(similarity_top_k=self.candidate_pool)
+
+    def close(self):
+        # Lexical searches already submitted still run, the worker threads exit once they're done
+        self._executor.shutdown(wait=False)
+        super().close()
+
+    def _submit_lexical(self, queries: list[str], top_k: int, allowed_ids: np.ndarray | None) -> Future:
+        try:
+            return self._executor.submit(self._lexical_search, queries, top_k, allowed_ids)
+        except RuntimeError:
+            # Closed by a reload while this query was running; finish it on the caller's thread
+            future = Future()
+            future.set_result(self._lexical_search(queries, top_k, allowed_ids))
+            return future
+
+    def _retrieve_nodes(self, query: str, normalized_query: str, top_k: int,
+                        allowed_ids: np.ndarray | None = None) -> list[NodeWithScore]:
+        pool_size = max(self.candidate_pool, top_k)
+        lexical_future = self._submit_lexical([query], pool_size, allowed_ids)
+        dense_nodes = super()._retrieve_nodes(query, normalized_query, pool_size, allowed_ids)
+        return self._fuse(dense_nodes, lexical_future.result()[0], top_k)
+
+    def _retrieve_nodes_many(self, queries: list[str], normalized_queries: list[str], top_k: int,
+                             allowed_ids: np.ndarray | None = None) -> list[list[NodeWithScore]]:
+        pool_size = max(self.candidate_pool, top_k)
+        lexical_future = self._submit_lexical(queries, pool_size, allowed_ids)
+        dense_lists = self._dense_nodes_many(normalized_queries, pool_size, allowed_ids)
+        return [
+            self._fuse(dense_nodes, lexical_hits, top_k)
+            for dense_nodes, lexical_hits in zip(dense_lists, lexical_future.result())
+        ]
+
+    def _lexical_search(self, queries: list[str], top_k: int, allowed_ids: np.ndarray | None) -> list[list[tuple[int, float]]]:
+        lexical_index = self.index.get_lexical_index()
+        with metrics.timer("lexical"):
+            return [lexical_index.search(query, top_k, allowed_ids) for query in queries]
+
+    def _fuse(self, dense_nodes: list[NodeWithScore], lexical_hits: list[tuple[int, float]], top_k: int) -> list[NodeWithScore]:
+        fused: dict[str, float] = {}
+        nodes = {}
+        for rank, node in enumerate(dense_nodes):
+            fused[node.node.node_id] = fused.get(node.node.node_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+            nodes[node.node.node_id] = node.node
+        with metrics.timer("lookup"):
+            lexical_nodes = self.index.get_nodes([vector_id for vector_id, _ in lexical_hits])
+        for rank, node in enumerate(lexical_nodes):
+            if node is None:
+                continue
+            fused[node.node_id] = fused.get(node.node_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+            nodes.setdefault(node.node_id, node)
 
+        ranked = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        return [NodeWithScore(node=nodes[node_id], score=fused[node_id]) for node_id in ranked]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,210 @@
+import faiss
+import json
+import numpy as np
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticQueryCache:
+    """
+    Disk-backed cache of search results keyed by query embedding, shared across server restarts.
+
+    A query whose embedding is close enough to a cached one (cosine similarity >= threshold) gets the
+    cached results without searching or assembling a response. Entries are tagged with the index name,
+    its published version and the search parameters, and only match queries with the same tag, so a
+    newly published index version never serves results from the old one.
+
+    Entries live in SQLite; their embeddings are also kept in a small in-memory FAISS index that is
+    rebuilt from the database when the cache is opened.
+    """
+    def __init__(self, path: str, threshold: float = 0.95, ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 10_000):
+        """
+        Args:
+            path: SQLite file to keep the cache in. Created if missing.
+            threshold: Min cosine similarity between two queries to share results.
+            ttl_seconds: Entries older than this are dropped.
+            max_entries: Least recently used entries are dropped beyond this.
+        """
+        self.path = path
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._faiss_index = None
+        # (index name, version, params) -> ids of its entries, used to restrict the FAISS search
+        self._tags: dict[tuple[str, str, str], set[int]] = {}
+        self._entry_tags: dict[int, tuple[str, str, str]] = {}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # Several servers can share the file and delete each other's rows, so ids must never be reused:
+        # a reused id would point this process's in-memory index at another query's results.
+        # Caches created before AUTOINCREMENT was used are dropped and start empty.
+        schema = self._db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'entries'").fetchone()
+        if schema is not None and "AUTOINCREMENT" not in schema[0].upper():
+            self._db.execute("DROP TABLE entries")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                index_name TEXT NOT NULL,
+                version TEXT NOT NULL,
+                params TEXT NOT NULL,
+                query TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                results TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - ttl_seconds,))
+        self._db.commit()
+        for entry_id, index_name, version, params, embedding in self._db.execute(
+                "SELECT id, index_name, version, params, embedding FROM entries"):
+            self._add_to_index(entry_id, (index_name, version, params), np.frombuffer(embedding, dtype=np.float32))
+        logger.info(f"Opened semantic query cache {path} with {len(self._entry_tags)} entries.")
+
+
+    def _add_to_index(self, entry_id: int, tag: tuple[str, str, str], embedding: np.ndarray):
+        if self._faiss_index is None:
+            self._faiss_index = faiss.IndexIDMap2(faiss.IndexFlatIP(len(embedding)))
+        elif len(embedding) != self._faiss_index.d:
+            return
+        self._faiss_index.add_with_ids(embedding[np.newaxis, :], np.array([entry_id], dtype=np.int64))
+        self._tags.setdefault(tag, set()).add(entry_id)
+        self._entry_tags[entry_id] = tag
+
+
+    def _remove(self, entry_ids: list[int]):
+        if not entry_ids:
+            return
+        self._db.executemany("DELETE FROM entries WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+        self._faiss_index.remove_ids(np.array(entry_ids, dtype=np.int64))
+        for entry_id in entry_ids:
+            tag = self._entry_tags.pop(entry_id, None)
+            if tag is not None:
+                self._tags[tag].discard(entry_id)
+                if not self._tags[tag]:
+                    del self._tags[tag]
+
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        embedding = np.array(embedding, dtype=np.float32)
+        return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+
+    def get(self, embedding: list[float], index_name: str, version: str, params: str) -> tuple[str, ...] | None:
+        """
+        Cached results of the closest earlier query with the same tag, if it is similar enough.
+
+        Database errors, e.g. the file being locked by another server, count as a miss.
+        """
+        embedding = self._normalize(embedding)
+        with self._lock:
+            try:
+                return self._get(embedding, index_name, version, params)
+            except sqlite3.Error as e:
+                logger.warning(f"Semantic cache lookup failed, treating it as a miss: {e}")
+                self._rollback()
+                self.misses += 1
+                return None
+
+
+    def _get(self, embedding: np.ndarray, index_name: str, version: str, params: str) -> tuple[str, ...] | None:
+        entry_ids = self._tags.get((index_name, version, params))
+        if not entry_ids or len(embedding) != self._faiss_index.d:
+            self.misses += 1
+            return None
+        selector = faiss.IDSelectorBatch(np.fromiter(entry_ids, dtype=np.int64, count=len(entry_ids)))
+        similarities, ids = self._faiss_index.search(
+            embedding[np.newaxis, :], 1, params=faiss.SearchParameters(sel=selector))
+        if ids[0][0] < 0 or similarities[0][0] < self.threshold:
+            self.misses += 1
+            return None
+
+        entry_id = int(ids[0][0])
+        # The row must still be the entry this process indexed; another server may have deleted it
+        row = self._db.execute(
+            "SELECT results, created_at FROM entries WHERE id = ? AND index_name = ? AND version = ? AND params = ?",
+            (entry_id, index_name, version, params)).fetchone()
+        now = time.time()
+        if row is None or row[1] < now - self.ttl_seconds:
+            self._remove([entry_id])
+            self._db.commit()
+            self.misses += 1
+            return None
+        self._db.execute("UPDATE entries SET last_used = ? WHERE id = ?", (now, entry_id))
+        self._db.commit()
+        self.hits += 1
+        return tuple(json.loads(row[0]))
+
+
+    def put(self, embedding: list[float], index_name: str, version: str, params: str, query: str, results: tuple[str, ...]):
+        embedding = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            try:
+                self._put(embedding, index_name, version, params, query, results, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not write to the semantic cache: {e}")
+                self._rollback()
+
+
+    def _put(self, embedding: np.ndarray, index_name: str, version: str, params: str, query: str,
+             results: tuple[str, ...], now: float):
+        cursor = self._db.execute(
+            "INSERT INTO entries (index_name, version, params, query, embedding, results, created_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (index_name, version, params, query, embedding.tobytes(), json.dumps(list(results)), now, now))
+        self._add_to_index(cursor.lastrowid, (index_name, version, params), embedding)
+
+        overflow = len(self._entry_tags) - self.max_entries
+        if overflow > 0:
+            rows = self._db.execute("SELECT id FROM entries ORDER BY last_used LIMIT ?", (overflow,)).fetchall()
+            self._remove([row[0] for row in rows])
+        self._db.commit()
+
+
+    def purge(self, index_name: str, keep_version: str):
+        """
+        Drop the entries of every other version of an index; they can never match again.
+        """
+        with self._lock:
+            entry_ids = [entry_id for (name, version, _), ids in self._tags.items()
+                         if name == index_name and version != keep_version for entry_id in ids]
+            try:
+                self._remove(entry_ids)
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not purge the semantic cache: {e}")
+                self._rollback()
+
+
+    def _rollback(self):
+        try:
+            self._db.rollback()
+        except sqlite3.Error:
+            pass
+
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+    def __len__(self) -> int:
+        return len(self._entry_tags)
+
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,77 @@
+import json
+import os
+
+DEFAULT_SOURCES_FILE = "sources.json"
+DEFAULT_MODEL = "avsolatorio/GIST-small-Embedding-v0"
+# Kinds of source: how setup_index.py builds them and which filters their search tool takes
+SOURCE_TYPES = ("confluence", "handbook")
+RETRIEVER_TYPES = ("vector", "hybrid", "direct")
+# "background": loaded when the server starts, "lazy": loaded by the first request that needs it
+LOAD_MODES = ("background", "lazy")
+# Tool names the server keeps for itself; a source's search tool can't take them
+RESERVED_TOOLS = ("search_all", "search_many", "get_document", "server_status")
+
+
+class SourceConfig:
+    """
+    One knowledge base: where its index lives, how it is built and how the server exposes it.
+    """
+    def __init__(self, name: str, type: str, index_path: str, model: str = DEFAULT_MODEL, dimension: int = 384,
+                 tool: str | None = None, description: str | None = None, load: str = "background",
+                 retriever: str | None = None, **options):
+        """
+        Args:
+            name: Name the source is referred to by, e.g. in search_many and server_status.
+            type: One of SOURCE_TYPES.
+            index_path: Directory of the index, relative to the working directory.
+            model: Embedding model the index is built with.
+            dimension: Embedding dimension of the model.
+            tool: Name of the source's search tool, search_<name> by default.
+            description: Description of the search tool shown to clients.
+            load: One of LOAD_MODES.
+            retriever: One of RETRIEVER_TYPES, overrides the server's --hybrid/--direct for this source.
+            options: Build options for setup_index.py, e.g. spaces (confluence), handbook_path (handbook),
+                chunk_size, vector_dtype, reduced_dim, reduction.
+        """
+        if type not in SOURCE_TYPES:
+            raise ValueError(f"Source '{name}' has unknown type '{type}', expected one of {', '.join(SOURCE_TYPES)}.")
+        if load not in LOAD_MODES:
+            raise ValueError(f"Source '{name}' has unknown load mode '{load}', expected one of {', '.join(LOAD_MODES)}.")
+        if retriever is not None and retriever not in RETRIEVER_TYPES:
+            raise ValueError(f"Source '{name}' has unknown retriever '{retriever}', expected one of {', '.join(RETRIEVER_TYPES)}.")
+        self.name = name
+        self.type = type
+        self.index_path = index_path
+        self.model = model
+        self.dimension = dimension
+        self.tool = tool or f"search_{name}"
+        self.description = description or f"Search the {name} knowledge base for information."
+        self.load = load
+        self.retriever = retriever
+        self.options = options
+
+
+def load_sources(path: str = DEFAULT_SOURCES_FILE) -> list[SourceConfig]:
+    """
+    Read the source registry: a JSON file with a "sources" list, one object of SourceConfig arguments per source.
+
+    Raises:
+        ValueError: If a source is invalid, or two sources share a name or tool, or a source's tool would
+            replace one of the server's own (RESERVED_TOOLS).
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Source registry '{path}' does not exist.")
+    with open(path, "r") as f:
+        registry = json.load(f)
+
+    sources = [SourceConfig(**source) for source in registry.get("sources", [])]
+    for attribute in ("name", "tool"):
+        values = [getattr(source, attribute) for source in sources]
+        duplicates = sorted({value for value in values if values.count(value) > 1})
+        if duplicates:
+            raise ValueError(f"Duplicate source {attribute}s in '{path}': {', '.join(duplicates)}")
+    for source in sources:
+        if source.tool in RESERVED_TOOLS:
+            raise ValueError(f"Source '{source.name}' in '{path}' uses the tool name '{source.tool}', which the server "
+                             f"uses for its own tool. Set a different \"tool\" for it.")
+    return sources
@@ -0,0 +1,323 @@
+from src.retrieval_stuff.metrics import metrics
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.simple import DEFAULT_VECTOR_STORE, NAMESPACE_SEP
+from llama_index.core.vector_stores.types import DEFAULT_PERSIST_FNAME, VectorStoreQuery, VectorStoreQueryResult
+from llama_index.vector_stores.faiss import FaissVectorStore
+import numpy as np
+import os
+import threading
+import faiss
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Storage formats for the vectors themselves. float32 keeps them exact; the scalar quantizers
+# trade a little recall for 2x (float16) or 4x (sq8) less memory.
+VECTOR_DTYPES = {
+    "float32": None,
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+REDUCTIONS = ("pca", "truncate")
+# Maps the stored codes of flat/scalar quantized indexes instead of reading them into memory.
+# Only in newer FAISS releases; older ones read the index as usual.
+MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+
+def build_faiss_index(dimension: int, vector_dtype: str = "float32", reduced_dim: int | None = None, reduction: str = "pca"):
+    """
+    Build an empty id-mapped FAISS index for the given storage options.
+
+    Args:
+        dimension: Dimension of the embedding model.
+        vector_dtype: One of VECTOR_DTYPES.
+        reduced_dim: If set, vectors are reduced to this many dimensions before they are stored.
+        reduction: "pca" learns a projection from the data, "truncate" keeps the leading dimensions
+            and re-normalizes, which is what Matryoshka-trained models expect.
+
+    The reduction lives inside an `IndexPreTransform`, so FAISS applies it to queries automatically.
+    Anything other than float32 without reduction must be trained before vectors are added.
+    """
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unknown vector dtype {vector_dtype}, expected one of {list(VECTOR_DTYPES)}.")
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"Unknown reduction {reduction}, expected one of {list(REDUCTIONS)}.")
+
+    stored_dim = reduced_dim if reduced_dim and reduced_dim < dimension else dimension
+    if VECTOR_DTYPES[vector_dtype] is None:
+        faiss_index = faiss.IndexFlatL2(stored_dim)
+    else:
+        faiss_index = faiss.IndexScalarQuantizer(stored_dim, VECTOR_DTYPES[vector_dtype], faiss.METRIC_L2)
+
+    if stored_dim < dimension:
+        if reduction == "pca":
+            faiss_index = faiss.IndexPreTransform(faiss.PCAMatrix(dimension, stored_dim), faiss_index)
+        else:
+            faiss_index = faiss.IndexPreTransform(faiss.NormalizationTransform(stored_dim, 2.0), faiss_index)
+            faiss_index.prepend_transform(faiss.RemapDimensionsTransform(dimension, stored_dim, False))
+
+    return faiss.IndexIDMap2(faiss_index)
+
+
+def index_memory_bytes(faiss_index) -> int:
+    """
+    Size of a FAISS index once serialized, which is close to what it takes in memory.
+    """
+    return len(faiss.serialize_index(faiss_index))
+
+
+class IdMappedFaissVectorStore(FaissVectorStore):
+    """
+    FAISS vector store keyed by stable int64 ids instead of insertion position.
+
+    The wrapped index is always a `faiss.IndexIDMap2`, so vectors can be added and removed by id.
+    Deletes are tombstoned: the ids are hidden from search straight away and physically removed
+    by `compact()`, which runs in a background thread once the tombstone ratio gets too high.
+    Ids are handed back to LlamaIndex as strings, exactly like the base `FaissVectorStore`, so
+    indexes persisted by the plain store keep working.
+    """
+
+    _next_id = PrivateAttr()
+    _tombstones = PrivateAttr()
+    _lock = PrivateAttr()
+    _compaction_lock = PrivateAttr()
+    _compaction_thread = PrivateAttr()
+    _compaction_ratio = PrivateAttr()
+    _pending_adds = PrivateAttr()
+    _mmapped = PrivateAttr()
+
+    def __init__(self, faiss_index, compaction_ratio: float = 0.2):
+        """
+        Args:
+            faiss_index: The FAISS index to wrap. Anything that is not already an `IndexIDMap2` is
+                converted, keeping each vector's position as its id.
+            compaction_ratio: Fraction of tombstoned vectors that triggers a background compaction.
+        """
+        faiss_index = self._to_id_map(faiss_index)
+        super().__init__(faiss_index=faiss_index)
+
+        ids = faiss.vector_to_array(faiss_index.id_map)
+        self._next_id = int(ids.max()) + 1 if len(ids) else 0
+        self._tombstones = set()
+        self._lock = threading.RLock()
+        # Held for a whole compaction (or reencode), so a background compaction and one started by
+        # persist() never rebuild at the same time and swap in each other's snapshot
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread = None
+        self._compaction_ratio = compaction_ratio
+        self._pending_adds = None
+        self._mmapped = False
+
+
+    @classmethod
+    def from_persist_path(cls, persist_path: str, fs=None, mmap: bool = False) -> "IdMappedFaissVectorStore":
+        """
+        Args:
+            mmap: Memory-map the stored vectors rather than reading them into memory. The pages are
+                shared with every other process mapping the same file and only the ones searched
+                are paged in. The first add copies the index into memory.
+        """
+        if not mmap or not MMAP_FLAG:
+            return super().from_persist_path(persist_path=persist_path, fs=fs)
+        store = cls(faiss_index=faiss.read_index(persist_path, MMAP_FLAG))
+        store._mmapped = True
+        return store
+
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str, fs=None, mmap: bool = False) -> "IdMappedFaissVectorStore":
+        return cls.from_persist_path(persist_path=os.path.join(persist_dir, f"{DEFAULT_VECTOR_STORE}{NAMESPACE_SEP}{DEFAULT_PERSIST_FNAME}"), fs=fs, mmap=mmap)
+
+
+    @staticmethod
+    def _to_id_map(faiss_index):
+        if isinstance(faiss_index, faiss.IndexIDMap2):
+            return faiss_index
+
+        # Legacy indexes were built on a bare IndexFlatL2 where the vector id is its position.
+        # IndexIDMap2 needs an empty index to wrap, so copy the vectors across.
+        id_map = faiss.IndexIDMap2(faiss.IndexFlatL2(faiss_index.d))
+        if faiss_index.ntotal:
+            vectors = faiss_index.reconstruct_n(0, faiss_index.ntotal)
+            id_map.add_with_ids(vectors, np.arange(faiss_index.ntotal, dtype=np.int64))
+        return id_map
+
+
+    @property
+    def next_id(self) -> int:
+        """
+        Id the next added vector gets; ids are allocated in increasing order and never reused.
+        """
+        return self._next_id
+
+
+    @property
+    def tombstone_ratio(self) -> float:
+        total = self._faiss_index.ntotal
+        return len(self._tombstones) / total if total else 0.0
+
+
+    def add(self, nodes: list[BaseNode], **add_kwargs) -> list[str]:
+        """
+        Add nodes to the index under freshly allocated ids.
+        """
+        if not nodes:
+            return []
+
+        vectors = np.array([node.get_embedding() for node in nodes], dtype="float32")
+        with self._lock:
+            if self._mmapped:
+                # A mapped index can't grow in place
+                self._faiss_index = faiss.deserialize_index(faiss.serialize_index(self._faiss_index))
+                self._mmapped = False
+            ids = np.arange(self._next_id, self._next_id + len(nodes), dtype=np.int64)
+            self._next_id += len(nodes)
+            self._faiss_index.add_with_ids(vectors, ids)
+            if self._pending_adds is not None:
+                # A compaction is rebuilding from a snapshot; replay these onto the new index.
+                self._pending_adds.append((vectors, ids))
+        return [str(i) for i in ids]
+
+
+    def delete_ids(self, ids: list[str | int]):
+        """
+        Tombstone vectors by id. They disappear from search results immediately.
+        """
+        with self._lock:
+            self._tombstones.update(int(i) for i in ids)
+        self.maybe_compact()
+
+
+    def query(self, query: VectorStoreQuery, **kwargs) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise ValueError("Metadata filters not implemented for Faiss yet.")
+
+        query_embedding_np = np.array(query.query_embedding, dtype="float32")[np.newaxis, :]
+        dists, indices = self.search(query_embedding_np, query.similarity_top_k)
+
+        similarities, ids = [], []
+        for dist, idx in zip(dists[0], indices[0]):
+            if idx < 0:
+                continue
+            similarities.append(float(dist))
+            ids.append(str(idx))
+        return VectorStoreQueryResult(similarities=similarities, ids=ids)
+
+
+    def search(self, query_embeddings: np.ndarray, top_k: int,
+               allowed_ids: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Search several query embeddings in one FAISS call, skipping tombstoned vectors.
+
+        Args:
+            allowed_ids: If given, only these ids are searched. The restriction is applied inside FAISS,
+                so a filtered search still returns a full top_k when enough vectors match.
+
+        Returns:
+            (distances, ids) arrays of shape (num_queries, top_k). Missing results have id -1.
+        """
+        with self._lock:
+            faiss_index = self._faiss_index
+            params = self._search_params(allowed_ids)
+        with metrics.timer("search"):
+            return faiss_index.search(np.ascontiguousarray(query_embeddings, dtype="float32"), top_k, params=params)
+
+
+    def reconstruct(self, ids: list[str | int]) -> np.ndarray:
+        """
+        Stored vectors for the given ids, in the space the index searches in.
+
+        Reduced indexes store vectors after their PCA/truncation transform; FAISS reconstructs them
+        back to the full dimension, so the transform is re-applied to compare them like search does.
+        """
+        with self._lock:
+            faiss_index = self._faiss_index
+        vectors = faiss_index.reconstruct_batch(np.array([int(i) for i in ids], dtype=np.int64))
+        inner_index = faiss.downcast_index(faiss_index.index)
+        if isinstance(inner_index, faiss.IndexPreTransform):
+            for i in range(inner_index.chain.size()):
+                vectors = faiss.downcast_VectorTransform(inner_index.chain.at(i)).apply(vectors)
+        return vectors
+
+
+    def _search_params(self, allowed_ids: np.ndarray | None = None):
+        selector = None
+        if self._tombstones:
+            tombstones = np.fromiter(self._tombstones, dtype=np.int64, count=len(self._tombstones))
+            selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(tombstones))
+        if allowed_ids is not None:
+            allowed = faiss.IDSelectorBatch(np.ascontiguousarray(allowed_ids, dtype=np.int64))
+            selector = allowed if selector is None else faiss.IDSelectorAnd(allowed, selector)
+        return None if selector is None else faiss.SearchParameters(sel=selector)
+
+
+    def maybe_compact(self):
+        """
+        Start a background compaction if enough of the index is tombstoned.
+        """
+        with self._lock:
+            if self.tombstone_ratio < self._compaction_ratio:
+                return
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(target=self.compact, daemon=True)
+            self._compaction_thread.start()
+
+
+    def compact(self):
+        """
+        Physically drop tombstoned vectors.
+
+        The rebuild runs on a copy of the index so searches are never blocked behind it;
+        only the final swap takes the lock. Compactions run one at a time; a second call waits
+        for the first and then only removes what is still tombstoned.
+        """
+        with self._compaction_lock:
+            with self._lock:
+                if not self._tombstones:
+                    return
+                removed = set(self._tombstones)
+                # clone_index can't copy every VectorTransform, a serialization round trip can.
+                snapshot = faiss.deserialize_index(faiss.serialize_index(self._faiss_index))
+                self._pending_adds = []
+
+            snapshot.remove_ids(np.array(sorted(removed), dtype=np.int64))
+
+            with self._lock:
+                for vectors, ids in self._pending_adds:
+                    snapshot.add_with_ids(vectors, ids)
+                self._pending_adds = None
+                self._faiss_index = snapshot
+                self._mmapped = False
+                self._tombstones -= removed
+        logger.info(f"Compacted vector store, removed {len(removed)} vectors.")
+
+
+    def reencode(self, faiss_index):
+        """
+        Move every live vector into a new, typically compressed, index built by `build_faiss_index`.
+
+        The new index is trained on the current vectors first, so call this on a full precision
+        index once all documents are in. Ids are preserved.
+        """
+        with self._compaction_lock, self._lock:
+            ids = faiss.vector_to_array(self._faiss_index.id_map)
+            vectors = self._faiss_index.index.reconstruct_n(0, self._faiss_index.ntotal)
+            live = ~np.isin(ids, np.fromiter(self._tombstones, dtype=np.int64, count=len(self._tombstones)))
+            ids, vectors = ids[live], vectors[live]
+
+            if not faiss_index.is_trained:
+                faiss_index.train(vectors)
+            faiss_index.add_with_ids(vectors, ids)
+            self._faiss_index = faiss_index
+            self._mmapped = False
+            self._tombstones = set()
+
+
+    def persist(self, persist_path: str, fs=None):
+        # Never write tombstoned vectors to disk.
+        if self._tombstones:
+            self.compact()
+        super().persist(persist_path=persist_path, fs=fs)